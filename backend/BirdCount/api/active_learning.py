@@ -6,6 +6,7 @@ from typing import List,Tuple
 import json
 import cv2
 from BirdCount.api.get_boxes import select_top_patches_from_image
+from BirdCount.model_files import density_store
 import numpy as np
 
 router = APIRouter()
@@ -21,10 +22,16 @@ async def get_active_learning_images_birdcount(
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
+                # Walks ix_active_learning_birdcount_created and probes the completions
+                # primary key per entry, stopping after `limit` rows
                 query = """
-                        SELECT * FROM active_learning_birdcount
-                        WHERE NOT %s = ANY(user_ids)
-                        ORDER BY created_at ASC
+                        SELECT a.id, a.image_id, a.boxes, a.created_at
+                        FROM active_learning_birdcount a
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM active_learning_birdcount_completions c
+                            WHERE c.image_id = a.image_id AND c.user_id = %s
+                        )
+                        ORDER BY a.created_at ASC, a.id
                         LIMIT %s;
                         """
                 cur.execute(query, (user_id, limit))
@@ -54,17 +61,21 @@ async def add_active_learning_birdcount_entry(data: BirdCountInput):
             with conn.cursor() as cur:
                 print(data.boxes)
                 insert_query = """
-                    INSERT INTO active_learning_birdcount (image_id, boxes, dots)
-                    VALUES (%s, %s, %s);
+                    INSERT INTO active_learning_birdcount (image_id, boxes)
+                    VALUES (%s, %s);
                 """
                 cur.execute(
                     insert_query,
                     (
                         data.image_id,
-                        json.dumps([box.dict() for box in data.boxes]),
-                        json.dumps(data.dots)
+                        json.dumps([box.dict() for box in data.boxes])
                     )
                 )
+                if data.dots:
+                    cur.execute(
+                        "INSERT INTO active_learning_birdcount_dots (image_id, dots) VALUES (%s, %s);",
+                        (data.image_id, json.dumps(data.dots))
+                    )
                 conn.commit()
                 return {"message": "Entry added successfully"}
     except Exception as e:
@@ -87,22 +98,24 @@ async def update_active_learning_birdcount(input_data: UpdateBirdCountDotsInput)
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                # 1. Add user_id to the array if not already present
-                update_user_query = """
-                    UPDATE active_learning_birdcount
-                    SET user_ids = array_append(user_ids, %s)
-                    WHERE image_id = %s AND NOT %s = ANY(user_ids);
-                """
-                cur.execute(update_user_query, (input_data.user_id, input_data.image_id, input_data.user_id))
-
-                # 2. Append new sublist of dots (for one box) to the existing list of dot-lists
-                new_dots_sublist_json = json.dumps([dot.dict() for dot in input_data.dots])  # one box's dots
-                append_dots_query = """
-                    UPDATE active_learning_birdcount
-                    SET dots = dots || to_jsonb(ARRAY[%s]::jsonb[])
-                    WHERE image_id = %s;
-                """
-                cur.execute(append_dots_query, (new_dots_sublist_json, input_data.image_id))
+                # 1. Mark the image done for this user (the queue skips it from now on)
+                cur.execute(
+                    """
+                    INSERT INTO active_learning_birdcount_completions (image_id, user_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT DO NOTHING;
+                    """,
+                    (input_data.image_id, input_data.user_id)
+                )
+
+                # 2. One row per submitted box, instead of rewriting a growing array
+                cur.execute(
+                    """
+                    INSERT INTO active_learning_birdcount_dots (image_id, user_id, dots)
+                    VALUES (%s, %s, %s);
+                    """,
+                    (input_data.image_id, input_data.user_id, json.dumps([dot.dict() for dot in input_data.dots]))
+                )
 
                 conn.commit()
                 return {"message": "Entry updated successfully"}
@@ -116,7 +129,8 @@ async def update_active_learning_birdcount(input_data: UpdateBirdCountDotsInput)
 async def generate_and_add_boxes_for_active_learning(
     request: Request,
     file: UploadFile = File(...),
-    image_id: int = Form(...)
+    image_id: int = Form(...),
+    use_density: bool = Form(False),
 ):
     try:
         # Read and decode image
@@ -124,13 +138,17 @@ async def generate_and_add_boxes_for_active_learning(
         np_img = np.frombuffer(image_data, np.uint8)
         img = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
 
+        # Score against the density map stored at upload when asked (falls back to noise if there is none)
+        density_map = density_store.load_density(image_id) if use_density else None
+
         # Get top boxes from image
         selected_boxes = select_top_patches_from_image(
             img,
             num_total_patches=50,
             num_top_patches=5,
             max_patch_area_ratio=0.33,
-            seed=42
+            seed=42,
+            density_map=density_map,
         )
         print("Select Boxes",selected_boxes)
 
@@ -1,53 +1,60 @@
-import json
+import numpy as np
 import psycopg2
 from psycopg2.extras import DictCursor
 from typing import List
+from pydantic import BaseModel
 from fastapi import APIRouter, HTTPException, Request, Depends,Query
 from Common.shared_utils import logger, DB_CONFIG, MODEL_TYPE_BIRD_COUNT
 from Common.api.auth import get_current_user
 
+import torch
+
+import BirdCount.model_files.demomodified as demo
+from BirdCount.model_files import density_store
+from BirdCount.model_files.peaks import encode_peaks, scale_peaks, find_peaks, PEAKS_ENCODINGS, PEAKS_POINTS
+from BirdCount.model_files import roi
+from BirdCount.api import point_store
+
 router = APIRouter()
 
 def scale_coordinates(cluster_centers, original_size, target_size):
-    tensor_width, tensor_height = original_size
-    target_width, target_height = target_size
-    scale_x = 480 / tensor_width
-    scale_y = 384 / tensor_height
-    return [
-        {"x": int(point["x"] * scale_x), "y": int(point["y"] * scale_y)}
-        for point in cluster_centers
-    ]
+    # Annotations keep the 480x384 model frame; target_size is stored alongside them
+    return encode_peaks(scale_peaks(cluster_centers, original_size, (480, 384)))
 
 @router.get("/annotations")
 async def get_annotations(
     request: Request, 
     image_id: int = Query(..., description="Image ID to fetch annotations"),
+    encoding: str = Query(PEAKS_POINTS, alias="peaks_format", description="points (default), columnar or packed"),
     user_id: int = Depends(get_current_user),
 ):
+    if encoding not in PEAKS_ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"peaks_format must be one of {', '.join(PEAKS_ENCODINGS)}")
     try:
         with psycopg2.connect(**DB_CONFIG, cursor_factory=DictCursor) as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    """
-                    SELECT a.cluster_centers FROM annotations a 
-                    JOIN images i ON a.image_id = i.id 
-                    WHERE i.id = %s AND i.user_id = %s
-                    """,
+                    "SELECT id FROM images WHERE id = %s AND user_id = %s",
                     (image_id, user_id)
                 )
-                result = cur.fetchone()  # Fetch a single result
-
-        print(result["cluster_centers"])
-        if result and result["cluster_centers"]:
-            cluster_centers = result["cluster_centers"]   # Convert to JSON
-            
-        else:
-            cluster_centers = []
-        return {"annotations": cluster_centers}
+                annotation = point_store.load_points(cur, image_id) if cur.fetchone() else None
+
+        return {"annotations": encode_peaks(annotation[3] if annotation else [], encoding)}
     except Exception as e:
         logger.error(f"Database error in GET /annotations: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+def _check_owner(cur, image_id, user_id):
+    cur.execute(
+        """
+        SELECT id FROM images 
+        WHERE id = %s AND user_id = %s AND model_type = %s
+        """,
+        (image_id, user_id, MODEL_TYPE_BIRD_COUNT)
+    )
+    if not cur.fetchone():
+        raise HTTPException(status_code=403, detail="Not authorized to modify this image")
+
 @router.post("/annotations")
 async def upload_annotations(
     request: Request, 
@@ -56,18 +63,10 @@ async def upload_annotations(
     user_id: int = Depends(get_current_user),
 ):
     try:
-        print(cluster_centers)
+        points = point_store.as_points(cluster_centers)
         with psycopg2.connect(**DB_CONFIG, cursor_factory=DictCursor) as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT id FROM images 
-                    WHERE id = %s AND user_id = %s AND model_type = %s
-                    """,
-                    (image_id, user_id, MODEL_TYPE_BIRD_COUNT)
-                )
-                if not cur.fetchone():
-                    raise HTTPException(status_code=403, detail="Not authorized to modify this image")
+                _check_owner(cur, image_id, user_id)
                 
                 cur.execute("SELECT width, height FROM annotations WHERE image_id = %s", (image_id,))
                 result = cur.fetchone()
@@ -77,19 +76,177 @@ async def upload_annotations(
                     target_width, target_height = 0, 0
                     
                 cur.execute("DELETE FROM annotations WHERE image_id = %s", (image_id,))
-                cluster_centers_json = json.dumps(cluster_centers)
-                
+                point_store.insert_points(cur, image_id, target_width, target_height, points)
+                conn.commit()
+        return {"message": "Annotation uploaded successfully"}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Annotation upload error in POST /annotations: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+class PointDeltaInput(BaseModel):
+    image_id: int
+    add: List[dict] = []     # [{"x": .., "y": ..}, ...]
+    remove: List[dict] = []  # points to delete, matched on whole-pixel coordinates
+
+
+@router.patch("/annotations/points")
+async def update_annotation_points(
+    data: PointDeltaInput,
+    user_id: int = Depends(get_current_user),
+):
+    """
+    Adds and removes individual points without the client resending the whole
+    set. The row is locked while the packed points are edited, so concurrent
+    deltas on one image apply one after the other.
+    """
+    try:
+        add, remove = point_store.as_points(data.add), point_store.as_points(data.remove)
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Points must be objects with numeric x and y")
+    try:
+        with psycopg2.connect(**DB_CONFIG, cursor_factory=DictCursor) as conn:
+            with conn.cursor() as cur:
+                _check_owner(cur, data.image_id, user_id)
+                annotation = point_store.load_points(cur, data.image_id, for_update=True)
+                if annotation is None:
+                    points, removed = point_store.apply_delta(np.zeros((0, 2), dtype=np.int32), add, remove)
+                    point_store.insert_points(cur, data.image_id, 0, 0, points)
+                else:
+                    points, removed = point_store.apply_delta(annotation[3], add, remove)
+                    point_store.update_points(cur, annotation[0], points)
+                conn.commit()
+        return {"image_id": data.image_id, "added": len(add), "removed": removed, "count": len(points)}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Annotation update error in PATCH /annotations/points: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.get("/annotations/rethreshold")
+async def rethreshold_annotations(
+    image_id: int = Query(..., description="Image ID whose stored density map is re-analysed"),
+    threshold: float = Query(demo.PEAK_THRESHOLD, ge=0, description="Minimum density for a peak"),
+    min_distance: int = Query(demo.PEAK_MIN_DISTANCE, ge=1, le=64, description="Peak suppression window in pixels"),
+    user_id: int = Depends(get_current_user),
+):
+    """Recomputes peaks, count and grid counts from the density map stored at upload, without running the model."""
+    try:
+        with psycopg2.connect(**DB_CONFIG, cursor_factory=DictCursor) as conn:
+            with conn.cursor() as cur:
                 cur.execute(
                     """
-                    INSERT INTO annotations (image_id, width, height, cluster_centers)
-                    VALUES (%s, %s, %s, %s)
+                    SELECT width, height FROM images 
+                    WHERE id = %s AND user_id = %s AND model_type = %s
                     """,
-                    (image_id, target_width, target_height, cluster_centers_json)
+                    (image_id, user_id, MODEL_TYPE_BIRD_COUNT)
                 )
-                conn.commit()
-        return {"message": "Annotation uploaded successfully"}
+                image = cur.fetchone()
+        if not image:
+            raise HTTPException(status_code=404, detail="Image not found")
+
+        density_map = density_store.load_density(image_id)
+        if density_map is None:
+            raise HTTPException(status_code=404, detail="No stored density map for this image")
+
+        outputs = {demo.OUTPUT_PEAKS, demo.OUTPUT_COUNT, demo.OUTPUT_GRID}
+        result = demo.postprocess_nomongo(
+            torch.from_numpy(density_map), outputs, density_map.shape,
+            peak_threshold=threshold, peak_min_distance=min_distance,
+        )
+        return {
+            "image_id": image_id,
+            "threshold": threshold,
+            "min_distance": min_distance,
+            "count": result[demo.OUTPUT_COUNT],
+            "gridmap": demo.subgrid_counts_with_error(result[demo.OUTPUT_GRID]),
+            "annotations": scale_coordinates(result[demo.OUTPUT_PEAKS], (480, 384), (image["width"], image["height"])),
+        }
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Annotation upload error in POST /annotations: {e}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
+        logger.error(f"Error in GET /annotations/rethreshold: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+# Upper bounds on polygons per ROI request and vertices per polygon (rasterizing allocates rows x edges)
+MAX_ROI_POLYGONS = 256
+MAX_ROI_VERTICES = 1024
+
+
+class RoiCountInput(BaseModel):
+    image_id: int
+    polygons: List[List[List[float]]]  # each polygon is [[x, y], ...]
+    frame: str = "image"  # "image": original image pixels, "model": the 480x384 annotation frame
+    threshold: float = demo.PEAK_THRESHOLD
+    min_distance: int = demo.PEAK_MIN_DISTANCE
+    peaks_format: str = PEAKS_POINTS
+
+
+@router.post("/annotations/roi_counts")
+async def roi_counts(
+    data: RoiCountInput,
+    user_id: int = Depends(get_current_user),
+):
+    """
+    Counts and peaks inside each polygon (a nesting island, a transect strip...)
+    from the density map stored at upload, without re-running the model.
+    Peaks come back in the same frame as the polygons.
+    """
+    if data.frame not in ("image", "model"):
+        raise HTTPException(status_code=400, detail="frame must be 'image' or 'model'")
+    if data.peaks_format not in PEAKS_ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"peaks_format must be one of {', '.join(PEAKS_ENCODINGS)}")
+    if data.threshold < 0 or not 1 <= data.min_distance <= 64:
+        raise HTTPException(status_code=400, detail="threshold must be >= 0 and min_distance between 1 and 64")
+    if not data.polygons or len(data.polygons) > MAX_ROI_POLYGONS:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_ROI_POLYGONS} polygons")
+    if any(len(polygon) < 3 or any(len(point) != 2 for point in polygon) for polygon in data.polygons):
+        raise HTTPException(status_code=400, detail="Each polygon needs at least 3 [x, y] points")
+    if any(len(polygon) > MAX_ROI_VERTICES for polygon in data.polygons):
+        raise HTTPException(status_code=400, detail=f"Polygons can have at most {MAX_ROI_VERTICES} points")
+    try:
+        with psycopg2.connect(**DB_CONFIG, cursor_factory=DictCursor) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT width, height FROM images 
+                    WHERE id = %s AND user_id = %s AND model_type = %s
+                    """,
+                    (data.image_id, user_id, MODEL_TYPE_BIRD_COUNT)
+                )
+                image = cur.fetchone()
+        if not image:
+            raise HTTPException(status_code=404, detail="Image not found")
+
+        density_map = density_store.load_density(data.image_id)
+        if density_map is None:
+            raise HTTPException(status_code=404, detail="No stored density map for this image")
+
+        # Polygons are rasterized on the density map's own grid
+        map_h, map_w = density_map.shape
+        frame_size = (image["width"], image["height"]) if data.frame == "image" else (480, 384)
+        sx, sy = map_w / frame_size[0], map_h / frame_size[1]
+        polygons = [[[x * sx, y * sy] for x, y in polygon] for polygon in data.polygons]
+
+        peaks = find_peaks(density_map, data.threshold, data.min_distance)
+        regions = roi.region_counts(density_map, polygons, peaks)
+        return {
+            "image_id": data.image_id,
+            "frame": data.frame,
+            "regions": [
+                {
+                    "index": i,
+                    "count": region["count"],
+                    "peaks": encode_peaks(scale_peaks(region["peaks"], (map_w, map_h), frame_size), data.peaks_format),
+                }
+                for i, region in enumerate(regions)
+            ],
+        }
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error in POST /annotations/roi_counts: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -0,0 +1,289 @@
+import os
+import json
+import uuid
+import queue
+import shutil
+import threading
+from zipfile import ZipFile
+
+from psycopg2.extras import execute_values
+from fastapi.concurrency import run_in_threadpool
+
+from Common.shared_utils import logger, UPLOAD_DIR, get_db_connection, MODEL_TYPE_BIRD_COUNT
+
+import BirdCount.model_files.demomodified as demo
+from BirdCount.model_files import density_store
+from BirdCount.model_files.preprocess import decode_image
+from BirdCount.api import point_store
+
+# Threads decoding extracted images while the model counts earlier ones
+DECODE_WORKERS = int(os.getenv('BIRDCOUNT_UPLOAD_DECODE_WORKERS', '4'))
+# Capacity of each queue between stages; bounds decoded images held in memory
+STAGE_QUEUE_SIZE = int(os.getenv('BIRDCOUNT_UPLOAD_QUEUE_SIZE', '16'))
+# Images per counting call and rows per DB transaction
+COUNT_BATCH = int(os.getenv('BIRDCOUNT_UPLOAD_COUNT_BATCH', '8'))
+DB_BATCH = int(os.getenv('BIRDCOUNT_UPLOAD_DB_BATCH', '32'))
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+_DONE = object()
+
+
+def archive_images(path):
+    """Image members of a zip archive, skipping macOS metadata."""
+    with ZipFile(path) as zip_ref:
+        return [
+            info for info in zip_ref.infolist()
+            if info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            and "__MACOSX" not in info.filename
+            and not os.path.basename(info.filename).startswith("._")
+        ]
+
+
+class FolderCountPipeline:
+    """
+    Counts the images of uploaded archives as four stages joined by bounded
+    queues, each on its own thread(s):
+
+        extract (one member at a time to UPLOAD_DIR)
+        -> decode (DECODE_WORKERS threads)
+        -> count (COUNT_BATCH images per model call)
+        -> store (DB_BATCH images per transaction, plus density maps)
+
+    Progress is reported through `events()`, an async generator of SSE lines
+    in the same shape as the object-detection folder upload.
+    """
+
+    def __init__(self, archives, user_id, consent):
+        self.archives = archives
+        self.user_id = user_id
+        self.consent = consent
+        self.total = sum(len(members) for _, members in archives)
+        self.stop = threading.Event()
+        self.decoded = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+        self.extracted = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+        self.counted = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+        self.progress = queue.Queue()
+        self.uploaded_image_ids = []
+        # Images stored or skipped so far; both decoders and the store stage advance it
+        self.completed = 0
+        self._completed_lock = threading.Lock()
+
+    def _put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q, timeout=None):
+        """q.get() that gives up (returning the end marker) once the pipeline is stopped."""
+        if timeout is not None:
+            return q.get(timeout=timeout)
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _advance(self, n):
+        with self._completed_lock:
+            self.completed += n
+            completed = self.completed
+        self.progress.put({
+            "progress": int(completed / self.total * 100) if self.total else 100,
+            "processed": completed,
+            "total": self.total,
+        })
+
+    def _discard(self, file_path):
+        """Removes an extracted image that will never reach the images table."""
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except OSError as e:
+            logger.warning(f"Could not remove {file_path}: {e}")
+
+    def _fail(self, stage, e):
+        logger.error(f"BirdCount folder upload failed while {stage}: {e}")
+        self.progress.put({"error": f"Failed while {stage}: {e}"})
+        self.stop.set()
+
+    def _extract(self):
+        try:
+            for path, members in self.archives:
+                with ZipFile(path) as zip_ref:
+                    for info in members:
+                        if self.stop.is_set():
+                            return
+                        original_filename = os.path.basename(info.filename)
+                        unique_filename = f"{uuid.uuid4()}_{original_filename}"
+                        file_path = os.path.join(UPLOAD_DIR, unique_filename)
+                        with zip_ref.open(info) as source, open(file_path, 'wb') as target:
+                            shutil.copyfileobj(source, target)
+                        if not self._put(self.extracted, (unique_filename, file_path)):
+                            self._discard(file_path)
+        except Exception as e:
+            self._fail("extracting", e)
+        finally:
+            for _ in range(DECODE_WORKERS):
+                self._put(self.extracted, _DONE)
+
+    def _decode(self):
+        try:
+            while not self.stop.is_set():
+                item = self._get(self.extracted)
+                if item is _DONE:
+                    break
+                unique_filename, file_path = item
+                try:
+                    # Draft-mode decode; the counting stage only resizes what we hand it
+                    image, original_size = decode_image(file_path)
+                except Exception as e:
+                    logger.error(f"Skipping unreadable image {unique_filename}: {e}")
+                    self._discard(file_path)
+                    self.progress.put({"skipped": unique_filename})
+                    self._advance(1)
+                    continue
+                if not self._put(self.decoded, (unique_filename, file_path, original_size, image)):
+                    self._discard(file_path)
+        except Exception as e:
+            self._fail("decoding", e)
+        finally:
+            self._put(self.decoded, _DONE)
+
+    def _count(self):
+        finished_decoders = 0
+        try:
+            while finished_decoders < DECODE_WORKERS and not self.stop.is_set():
+                batch = []
+                while len(batch) < COUNT_BATCH and finished_decoders < DECODE_WORKERS:
+                    try:
+                        # Block for the first image, then only take what is already decoded
+                        item = self._get(self.decoded, timeout=None if not batch else 0.05)
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        finished_decoders += 1
+                    else:
+                        batch.append(item)
+                if not batch:
+                    continue
+                try:
+                    results = demo.count_images_nomongo([image for _, _, _, image in batch],
+                                                        {demo.OUTPUT_PEAKS, demo.OUTPUT_DENSITY, demo.OUTPUT_COUNT})
+                except Exception as infer_err:
+                    logger.error(f"Inference error for a batch of {len(batch)} images: {infer_err}")
+                    results = [None] * len(batch)
+                for (unique_filename, file_path, original_size, _), result in zip(batch, results):
+                    if not self._put(self.counted, (unique_filename, file_path, original_size, result)):
+                        self._discard(file_path)
+        except Exception as e:
+            self._fail("counting", e)
+        finally:
+            self._put(self.counted, _DONE)
+
+    def _store_batch(self, cur, batch):
+        image_rows = [
+            (unique_filename, file_path, width, height, self.user_id, MODEL_TYPE_BIRD_COUNT, self.consent,
+             result[demo.OUTPUT_COUNT] if result is not None else None)
+            for unique_filename, file_path, (width, height), result in batch
+        ]
+        image_ids = [row[0] for row in execute_values(
+            cur,
+            """
+            INSERT INTO images (filename, filepath, width, height, user_id, model_type, consent, predicted_count)
+            VALUES %s
+            RETURNING id
+            """,
+            image_rows,
+            fetch=True,
+        )]
+
+        annotation_rows = []
+        counted = []
+        for image_id, (_, _, (width, height), result) in zip(image_ids, batch):
+            if result is None:
+                continue
+            counted.append((image_id, result[demo.OUTPUT_DENSITY]))
+            # Same coordinate convention as store_predictions() in upload.py
+            annotation_rows.append((image_id, width, height, *point_store.packed_row(result[demo.OUTPUT_PEAKS])))
+        if annotation_rows:
+            execute_values(
+                cur,
+                "INSERT INTO annotations (image_id, width, height, points, points_encoding, point_count) VALUES %s",
+                annotation_rows,
+            )
+        density_rows = density_store.density_rows(*zip(*counted)) if counted else []
+        if density_rows:
+            execute_values(cur, "INSERT INTO density_maps (image_id, density) VALUES %s", density_rows)
+        return image_ids
+
+    def _store(self):
+        batch = []
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    done = False
+                    while not done and not self.stop.is_set():
+                        batch = []
+                        while len(batch) < DB_BATCH:
+                            try:
+                                item = self._get(self.counted, timeout=None if not batch else 0.2)
+                            except queue.Empty:
+                                break
+                            if item is _DONE:
+                                done = True
+                                break
+                            batch.append(item)
+                        if not batch:
+                            continue
+                        image_ids = self._store_batch(cur, batch)
+                        conn.commit()
+                        self.uploaded_image_ids.extend(image_ids)
+                        self._advance(len(batch))
+                        batch = []
+            if not self.stop.is_set():
+                self.progress.put({"message": "Folders uploaded successfully",
+                                   "uploaded_image_ids": self.uploaded_image_ids})
+        except Exception as e:
+            # The failed transaction rolled back, so the batch in flight has no rows
+            for _, file_path, _, _ in batch:
+                self._discard(file_path)
+            self._fail("storing results", e)
+        finally:
+            self.progress.put(_DONE)
+
+    def start(self):
+        stages = [self._extract, self._count, self._store] + [self._decode] * DECODE_WORKERS
+        for i, stage in enumerate(stages):
+            threading.Thread(target=stage, name=f"birdcount-upload-{stage.__name__}-{i}", daemon=True).start()
+
+    def _cleanup(self):
+        for path, _ in self.archives:
+            if os.path.exists(path):
+                os.remove(path)
+        # Images still queued between stages when the pipeline stopped early never got a row
+        for q in (self.extracted, self.decoded, self.counted):
+            while True:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _DONE:
+                    self._discard(item[1])
+
+    async def events(self):
+        self.start()
+        try:
+            while True:
+                event = await run_in_threadpool(self.progress.get)
+                if event is _DONE:
+                    break
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            # Also reached when the client disconnects; stops the stages
+            self.stop.set()
+            self._cleanup()
@@ -1,39 +1,61 @@
 import cv2
 import numpy as np
 import random
-import math
 from jenkspy import JenksNaturalBreaks
-import torch
+
+GDSIM_LEVELS = 3
+
+
+def summed_area_table(density_map):
+    """Zero-padded 2-D prefix sums: sat[y, x] is the sum of density_map[:y, :x]."""
+    density_map = np.asarray(density_map, dtype=np.float64)
+    sat = np.zeros((density_map.shape[0] + 1, density_map.shape[1] + 1))
+    sat[1:, 1:] = density_map.cumsum(axis=0).cumsum(axis=1)
+    return sat
+
+
+def compute_gdsim_batch(density_map, boxes, levels=GDSIM_LEVELS):
+    """
+    Scores every box against one density map in a single vectorized pass.
+
+    For pyramid level L a box is split into 2^L x 2^L equal parts (remainder
+    rows/columns dropped, as integer division does), so the parts of a level
+    exactly tile one rectangle and their summed counts are one table lookup.
+
+    Args:
+        density_map: [H, W] density in the boxes' coordinate space.
+        boxes: (x1, y1, x2, y2) tuples.
+
+    Returns:
+        np.ndarray: one score per box.
+    """
+    if not boxes:
+        return np.zeros(0)
+    sat = summed_area_table(density_map)
+    b = np.asarray(boxes, dtype=np.int64)
+    x1, y1 = b[:, 0:1], b[:, 1:2]
+    w, h = b[:, 2:3] - x1, b[:, 3:4] - y1
+
+    parts = 2 ** np.arange(levels + 1)  # parts per side at each level
+    x2 = x1 + (w // parts) * parts
+    y2 = y1 + (h // parts) * parts
+    level_sums = sat[y2, x2] - sat[y1, x2] - sat[y2, x1] + sat[y1, x1]
+    return level_sums.sum(axis=1)
+
 
 def compute_gdsim(patch):
+    """Single-patch score against a random density map (kept for callers that score one patch)."""
     h, w = patch.shape[:2]
     density_map = np.random.rand(h, w).astype(np.float32)
+    return float(compute_gdsim_batch(density_map, [(0, 0, w, h)])[0])
 
-    def get_partition_counts(density_map, num_parts):
-        tensor = torch.from_numpy(density_map)
-        height, width = tensor.shape
-        parts_per_dim = int(math.sqrt(num_parts))
-        part_h = height // parts_per_dim
-        part_w = width // parts_per_dim
-        parts = []
-        for i in range(parts_per_dim):
-            for j in range(parts_per_dim):
-                part = tensor[i*part_h:(i+1)*part_h, j*part_w:(j+1)*part_w]
-                parts.append(torch.sum(part).item())
-        return parts
-
-    total = 0
-    for L in range(3 + 1):
-        num_parts = 4 ** L
-        parts = get_partition_counts(density_map, num_parts)
-        total += sum(parts)
-
-    return total
 
 def apply_jenks(scores, num_groups):
+    """Jenks class of every score, classified in one searchsorted call over the fitted breaks."""
     jnb = JenksNaturalBreaks(n_classes=num_groups)
     jnb.fit(scores)
-    return [jnb.predict([score])[0] for score in scores]
+    # Same rule as jnb.predict: first class whose upper break is >= the score
+    return np.searchsorted(np.asarray(jnb.breaks_[1:-1]), scores, side='left').tolist()
 
 def generate_random_patches(image, num_patches=50, max_area_ratio=0.33):
     h, w, _ = image.shape
@@ -55,7 +77,8 @@ def select_top_patches_from_image(
     num_total_patches: int = 50,
     num_top_patches: int = 5,
     max_patch_area_ratio: float = 0.33,
-    seed: int = 42
+    seed: int = 42,
+    density_map=None,
 ) -> list[tuple[int, int, int, int]]:
     """
     Resize the input image to 480×384 and return the top patches in that coordinate space.
@@ -66,6 +89,8 @@ def select_top_patches_from_image(
         num_top_patches: Number of top-scoring patches to return.
         max_patch_area_ratio: Max area of each patch as a ratio of total image area.
         seed: Random seed for reproducibility.
+        density_map: Optional model density map of the image (any size, resized
+            to 480×384). Without one, patches are scored against seeded noise.
 
     Returns:
         A list of (x1, y1, x2, y2) tuples in the 480×384 space.
@@ -78,8 +103,12 @@ def select_top_patches_from_image(
     random.seed(seed)
     boxes = generate_random_patches(resized, num_total_patches, max_patch_area_ratio)
 
-    # Score and group the patches
-    scores = [compute_gdsim(resized[y1:y2, x1:x2]) for (x1, y1, x2, y2) in boxes]
+    # Score all patches against one density map and group them
+    if density_map is None:
+        density_map = np.random.default_rng(seed).random((target_h, target_w), dtype=np.float32)
+    elif density_map.shape != (target_h, target_w):
+        density_map = cv2.resize(np.asarray(density_map, dtype=np.float32), (target_w, target_h))
+    scores = compute_gdsim_batch(density_map, boxes).tolist()
     groups = apply_jenks(scores, num_top_patches)
 
     # Combine and sort by score descending
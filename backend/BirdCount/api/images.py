@@ -1,9 +1,10 @@
 import os
 from typing import Optional
-from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi import APIRouter, Request, HTTPException, Depends, Query
 from fastapi.responses import FileResponse
 
 from Common.shared_utils import logger, get_db_connection, MODEL_TYPE_BIRD_COUNT
+from Common.api.auth import get_current_user
 
 from fastapi.responses import JSONResponse
 
@@ -50,4 +51,82 @@ async def get_images_birdcount(
         raise he
     except Exception as e:
         logger.error(f"Database error: {e}")
-        return JSONResponse(content={"error": str(e)}, status_code=500)
\ No newline at end of file
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+# Columns the listing can return; `url` is derived from the id
+LISTING_FIELDS = {
+    "id": "i.id",
+    "filename": "i.filename",
+    "width": "i.width",
+    "height": "i.height",
+    "created_at": "i.created_at",
+    "predicted_count": "i.predicted_count",
+    # Packed rows carry their count; rows not yet repacked fall back to the JSON length
+    "point_count": "COALESCE(a.point_count, CASE WHEN jsonb_typeof(a.cluster_centers) = 'array' "
+                   "THEN jsonb_array_length(a.cluster_centers) ELSE 0 END)",
+}
+DEFAULT_LISTING_FIELDS = ("id", "url", "filename", "width", "height", "point_count", "predicted_count")
+MAX_PAGE_SIZE = 500
+
+
+@router.get("/images_birdcount/")
+async def list_images_birdcount(
+    after_id: int = Query(0, ge=0, description="Return images with id greater than this (the previous page's next_after_id)"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description="Comma-separated subset of: url, " + ", ".join(LISTING_FIELDS)),
+    user_id: int = Depends(get_current_user),
+):
+    """
+    One page of the user's BirdCount images, keyset-paginated on id, with
+    the annotation point count and the upload-time model count inline so
+    the frontend doesn't fetch /annotations per image.
+    """
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(DEFAULT_LISTING_FIELDS)
+    unknown = [f for f in selected if f != "url" and f not in LISTING_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    columns = ["i.id"] + [f"{LISTING_FIELDS[f]} AS {f}" for f in selected if f in LISTING_FIELDS and f != "id"]
+    join = ""
+    if "point_count" in selected:
+        join = """
+            LEFT JOIN LATERAL (
+                SELECT point_count, cluster_centers FROM annotations
+                WHERE image_id = i.id ORDER BY id DESC LIMIT 1
+            ) a ON true"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                # Served by ix_images_user_model_id; one extra row tells whether there is a next page
+                cur.execute(
+                    f"""
+                    SELECT {', '.join(columns)} FROM images i{join}
+                    WHERE i.user_id = %s AND i.model_type = %s AND i.id > %s
+                    ORDER BY i.id
+                    LIMIT %s
+                    """,
+                    (user_id, MODEL_TYPE_BIRD_COUNT, after_id, limit + 1)
+                )
+                rows = cur.fetchall()
+    except Exception as e:
+        logger.error(f"Database error listing BirdCount images: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    images = []
+    for row in rows:
+        image = {}
+        for f in selected:
+            if f == "url":
+                image["url"] = f"/get_images_birdcount?image_id={row['id']}"
+            elif f == "created_at":
+                image[f] = row[f].isoformat() if row[f] else None
+            else:
+                image[f] = row[f]
+        images.append(image)
+    return {
+        "images": images,
+        "next_after_id": rows[-1]["id"] if has_more else None,
+    }
@@ -1,130 +1,331 @@
 import io
-from fastapi import APIRouter, UploadFile, File, Response, Depends
+import os
+import json
+from fastapi import APIRouter, UploadFile, File, Form, Response, Depends, HTTPException, Query
 from PIL import Image
 from torchvision import transforms
 
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import List
+from functools import partial
+
 from Common.api.auth import get_current_user
+from Common.shared_utils import logger, get_db_connection, MODEL_TYPE_BIRD_COUNT
 
 import BirdCount.model_files.demomodified as demo
+from BirdCount.model_files.result_cache import result_cache, content_hash
+from BirdCount.model_files import engine as counting_engine
+from BirdCount.model_files import render
+from BirdCount.model_files import tiling
+from BirdCount.model_files.inference_queue import inference_queue
+from BirdCount.model_files import density_store
+from BirdCount.model_files import peaks as peak_codec
+from BirdCount.model_files.preprocess import decode_image
+
+# Images per counting call in /model_count_batch/
+BULK_BATCH = int(os.getenv('BIRDCOUNT_BULK_BATCH', '8'))
 
 import math
 
 import numpy as np
 import torch
-from scipy import ndimage
 from PIL import Image
 
 router = APIRouter()
 
-def helper_get_heatmap(file: UploadFile = File(...)):
-    image = Image.open(file.file)
-    if image.format == "PNG":
-        # Convert to RGB (as PNG can have alpha channel)
-        image = image.convert("RGB")
+def cached_count_results(keys, load_image, outputs, image_keys=None, **count_options):
+    """
+    Counting results for the images behind `keys`, computing only what the cache
+    can't answer. Cached entries always keep the raw density map, so an output
+    that wasn't requested the first time is derived from it without rerunning
+    the model. `load_image(i)` is only called for images that need work.
 
-        # Save to a bytes buffer in JPEG format
-        buffer = io.BytesIO()
-        image.save(buffer, format="JPEG")
-        buffer.seek(0)
+    `image_keys` identify the image pixels alone (defaults to `keys`) and key
+    the model's encoder-latent cache; `count_options` go to count_images_nomongo.
+    """
+    image_keys = image_keys or keys
+    outputs = frozenset(outputs) | {demo.OUTPUT_DENSITY}
+    results = [result_cache.get(key) for key in keys]
+
+    # Entries written before results were dicts (legacy tuples on disk) are recomputed
+    missing = [i for i, result in enumerate(results) if not isinstance(result, dict)]
+    if missing:
+        computed = demo.count_images_nomongo([load_image(i) for i in missing], outputs,
+                                             image_keys=[image_keys[i] for i in missing], **count_options)
+        for i, result in zip(missing, computed):
+            results[i] = result
+            result_cache.put(keys[i], result)
+
+    for i, result in enumerate(results):
+        lacking = outputs - result.keys()
+        if lacking:
+            results[i] = demo.complete_result_nomongo(result, load_image(i), lacking)
+            result_cache.put(keys[i], results[i])
+    return results
+
+def run_demo_cached(file: UploadFile = File(...), outputs=demo.ALL_OUTPUTS):
+    """Runs the counting model once per distinct upload; later calls are served from the result cache."""
+    file.file.seek(0)
+    data = file.file.read()
+    key = content_hash(data)
+    # The counting pipeline decodes the bytes itself (once, draft mode for JPEGs)
+    return cached_count_results([key], lambda i: data, outputs)[0]
+
+def heatmap_format(image_format):
+    """Validates the requested heatmap encoding before any model work is done."""
+    try:
+        return render.resolve_format(image_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def peaks_format(encoding):
+    """Validates the requested cluster_centers encoding; points (the stored annotation shape) by default."""
+    encoding = (encoding or peak_codec.PEAKS_POINTS).lower()
+    if encoding not in peak_codec.PEAKS_ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"peaks_format must be one of {', '.join(peak_codec.PEAKS_ENCODINGS)}")
+    return encoding
+
+PEAKS_FORMAT_DESCRIPTION = "points (default), columnar ({x: [], y: []}) or packed (base64 int16 pairs)"
+
+def heatmap_response(image, image_format):
+    content, media_type = render.encode_image(image, image_format)
+    return Response(content=content, media_type=media_type)
 
-        # Re-open the image from the buffer
-        image = Image.open(buffer)
-    count, elapsed_time, heatmap_file, cluster_centers, image_dimensions,subgrid_counts,pred_cnt_flt,subgridcounts_error = demo.run_demo_image_nomongo(image)
-    return heatmap_file
+def helper_get_heatmap(file: UploadFile = File(...)):
+    return run_demo_cached(file, {demo.OUTPUT_OVERLAY})[demo.OUTPUT_OVERLAY]
 
 @router.post("/model_heatmap/")
 async def predict(
     file: UploadFile = File(...),
+    image_format: str = Query(None, alias="format", description="png (default), jpeg or webp"),
     user_id: int = Depends(get_current_user),
 ):
-    heatmap_file=helper_get_heatmap(file)
-    to_pil = transforms.ToPILImage()
-    image = to_pil(heatmap_file)
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    buffer.seek(0)
-    return Response(content=buffer.getvalue(), media_type="image/png")
+    image_format = heatmap_format(image_format)
+    heatmap_file = await run_in_threadpool(helper_get_heatmap, file)
+    return await run_in_threadpool(heatmap_response, heatmap_file, image_format)
 
 def helper_get_gridmap(file: UploadFile = File(...)):
-    image = Image.open(file.file)
-    if image.format == "PNG":
-        # Convert to RGB (as PNG can have alpha channel)
-        image = image.convert("RGB")
-
-        # Save to a bytes buffer in JPEG format
-        buffer = io.BytesIO()
-        image.save(buffer, format="JPEG")
-        buffer.seek(0)
-
-        # Re-open the image from the buffer
-        image = Image.open(buffer)
-    count, elapsed_time, heatmap_file, cluster_centers, image_dimensions,subgrid_counts,pred_cnt_flt,subgridcounts_error = demo.run_demo_image_nomongo(image)
-    return subgridcounts_error
+    subgrid_counts = run_demo_cached(file, {demo.OUTPUT_GRID})[demo.OUTPUT_GRID]
+    return demo.subgrid_counts_with_error(subgrid_counts)
 
 @router.post("/model_gridmap/")
 async def predict(
     file: UploadFile = File(...),
     user_id: int = Depends(get_current_user),
 ):
-    gridmap=helper_get_gridmap(file)
+    gridmap = await run_in_threadpool(helper_get_gridmap, file)
     return gridmap
 
 def helper_get_count(file: UploadFile = File(...)):
-    image = Image.open(file.file)
-    if image.format == "PNG":
-        # Convert to RGB (as PNG can have alpha channel)
-        image = image.convert("RGB")
-
-        # Save to a bytes buffer in JPEG format
-        buffer = io.BytesIO()
-        image.save(buffer, format="JPEG")
-        buffer.seek(0)
-
-        # Re-open the image from the buffer
-        image = Image.open(buffer)
-    count, elapsed_time, heatmap_file, cluster_centers, image_dimensions,subgrid_counts,pred_cnt_flt,subgridcounts_error = demo.run_demo_image_nomongo(image)
-    return pred_cnt_flt
+    return run_demo_cached(file, {demo.OUTPUT_COUNT})[demo.OUTPUT_COUNT]
 
 @router.post("/model_count/")
 async def predict(
     file: UploadFile = File(...),
     user_id: int = Depends(get_current_user),
 ):
-    count=helper_get_count(file)
+    count = await run_in_threadpool(helper_get_count, file)
     return count
 
-def helper_get_cluster1(file: UploadFile = File(...)):
-    image = Image.open(file.file)
-    if image.format == "PNG":
-        # Convert to RGB (as PNG can have alpha channel)
-        image = image.convert("RGB")
-
-        # Save to a bytes buffer in JPEG format
-        buffer = io.BytesIO()
-        image.save(buffer, format="JPEG")
-        buffer.seek(0)
-
-        # Re-open the image from the buffer
-        image = Image.open(buffer)
-    original_tensor_size = (480, 384)  # Tensor size (width, height)
-    target_image_size = image.size  # Actual image size (width, height)
-    print(image.size)
-
-    # Replace the demo logic with the real function generating cluster centers
-    count, elapsed_time, heatmap_file, cluster_centers, image_dimensions, subgrid_counts, pred_cnt_flt, subgridcounts_error = demo.run_demo_image_nomongo(image)
-    return cluster_centers
+def helper_get_cluster1(file: UploadFile = File(...), encoding=peak_codec.PEAKS_POINTS):
+    return peak_codec.encode_peaks(run_demo_cached(file, {demo.OUTPUT_PEAKS})[demo.OUTPUT_PEAKS], encoding)
 
 
 @router.post("/model_cluster/")
 async def predict(
     file: UploadFile = File(...),
+    encoding: str = Query(None, alias="peaks_format", description=PEAKS_FORMAT_DESCRIPTION),
     user_id: int = Depends(get_current_user),                  
 ):
-    cluster_centers=helper_get_cluster1(file)
+    encoding = peaks_format(encoding)
+    cluster_centers = await run_in_threadpool(helper_get_cluster1, file, encoding)
     return cluster_centers
 
 
 
+BULK_OUTPUTS = frozenset({demo.OUTPUT_COUNT, demo.OUTPUT_GRID, demo.OUTPUT_PEAKS})
+
+
+def bulk_line(result, encoding=peak_codec.PEAKS_POINTS, **fields):
+    return json.dumps({
+        **fields,
+        "count": result[demo.OUTPUT_COUNT],
+        "gridmap": demo.subgrid_counts_with_error(result[demo.OUTPUT_GRID]),
+        "cluster_centers": peak_codec.encode_peaks(result[demo.OUTPUT_PEAKS], encoding),
+    }) + "\n"
+
+
+def bulk_count_batch(sources, encoding=peak_codec.PEAKS_POINTS):
+    """
+    Counts one batch of bulk items. `sources` are (fields, read_bytes) pairs;
+    bytes are read and hashed here so only one batch is held in memory.
+    Returns NDJSON lines in input order; failures become error lines.
+    """
+    datas, lines = [], [None] * len(sources)
+    for i, (fields, read_bytes) in enumerate(sources):
+        try:
+            data = read_bytes()
+        except Exception as e:
+            lines[i] = json.dumps({**fields, "error": f"Could not read image: {e}"}) + "\n"
+            continue
+        # Decoded here so a corrupt upload fails on its own line instead of taking the batched model call down
+        try:
+            image, _ = decode_image(data)
+        except Exception as e:
+            lines[i] = json.dumps({**fields, "error": f"Could not decode image: {e}"}) + "\n"
+            continue
+        datas.append((i, content_hash(data), image))
+    if datas:
+        keys = [key for _, key, _ in datas]
+        try:
+            results = cached_count_results(keys, lambda j: datas[j][2], BULK_OUTPUTS)
+        except Exception as e:
+            logger.error(f"Bulk count batch failed: {e}")
+            results = [e] * len(datas)
+        for (i, _, _), result in zip(datas, results):
+            fields = sources[i][0]
+            lines[i] = (json.dumps({**fields, "error": str(result)}) + "\n"
+                        if isinstance(result, Exception) else bulk_line(result, encoding, **fields))
+    return lines
+
+
+def stored_density_line(image_id, encoding=peak_codec.PEAKS_POINTS):
+    """Count line straight from the density map kept at upload, or None if there isn't one."""
+    density_map = density_store.load_density(image_id)
+    if density_map is None:
+        return None
+    result = demo.postprocess_nomongo(torch.from_numpy(density_map), BULK_OUTPUTS, density_map.shape)
+    return bulk_line(result, encoding, image_id=image_id)
+
+
+@router.post("/model_count_batch/")
+async def count_batch(
+    files: List[UploadFile] = File(None),
+    image_ids: List[int] = Form(None),
+    encoding: str = Query(None, alias="peaks_format", description=PEAKS_FORMAT_DESCRIPTION),
+    user_id: int = Depends(get_current_user),
+):
+    """
+    Counts many images in one request: uploaded `files` and/or already uploaded
+    `image_ids`. Streams one NDJSON line per image (count, gridmap,
+    cluster_centers, or error) as each batch finishes. Images are counted
+    BULK_BATCH at a time through the result cache; image ids with a stored
+    density map skip the model entirely.
+    """
+    encoding = peaks_format(encoding)
+    files = files or []
+    image_ids = image_ids or []
+    if not files and not image_ids:
+        raise HTTPException(status_code=400, detail="Send files or image_ids")
+
+    paths = {}
+    if image_ids:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT id, filepath FROM images
+                    WHERE id = ANY(%s) AND user_id = %s AND model_type = %s
+                    """,
+                    (image_ids, user_id, MODEL_TYPE_BIRD_COUNT)
+                )
+                paths = {row["id"]: row["filepath"] for row in cur.fetchall()}
+
+    def read_path(path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def read_upload(file):
+        file.file.seek(0)
+        return file.file.read()
+
+    async def lines():
+        sources = []
+        for image_id in image_ids:
+            if image_id not in paths:
+                yield json.dumps({"image_id": image_id, "error": "Image not found"}) + "\n"
+                continue
+            try:
+                line = await run_in_threadpool(stored_density_line, image_id, encoding)
+            except Exception as e:
+                logger.error(f"Stored density count failed for image {image_id}: {e}")
+                yield json.dumps({"image_id": image_id, "error": str(e)}) + "\n"
+                continue
+            if line is not None:
+                yield line
+                continue
+            sources.append(({"image_id": image_id}, partial(read_path, paths[image_id])))
+        sources.extend(({"index": i, "filename": file.filename}, partial(read_upload, file))
+                       for i, file in enumerate(files))
+
+        for b in range(0, len(sources), BULK_BATCH):
+            for line in await run_in_threadpool(bulk_count_batch, sources[b:b + BULK_BATCH], encoding):
+                yield line
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/model_recount/")
+async def recount(
+    file: UploadFile = File(...),
+    exemplars: str = Form(..., description="JSON list of up to 3 [x1, y1, x2, y2] boxes in image pixels"),
+    encoding: str = Query(None, alias="peaks_format", description=PEAKS_FORMAT_DESCRIPTION),
+    user_id: int = Depends(get_current_user),
+):
+    """
+    Counts with user-picked example birds. The encoder output of the image's
+    windows is cached, so picking new exemplars only reruns the decoder.
+    """
+    encoding = peaks_format(encoding)
+    try:
+        boxes = [tuple(float(v) for v in box) for box in json.loads(exemplars)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="exemplars must be a JSON list of [x1, y1, x2, y2] boxes")
+    if len(boxes) > 3 or any(len(box) != 4 for box in boxes):
+        raise HTTPException(status_code=400, detail="Give at most 3 exemplar boxes of 4 coordinates each")
+
+    file.file.seek(0)
+    data = file.file.read()
+    key = content_hash(data)
+    width, height = Image.open(io.BytesIO(data)).size
+    for x1, y1, x2, y2 in boxes:
+        if not (0 <= x1 < x2 <= width and 0 <= y1 < y2 <= height):
+            raise HTTPException(status_code=400, detail=f"Exemplar box {[x1, y1, x2, y2]} is not inside the {width}x{height} image")
+
+    exemplar_key = content_hash(json.dumps(boxes).encode())
+    results = await run_in_threadpool(
+        cached_count_results,
+        [f"{key}:exemplars:{exemplar_key}"], lambda i: data,
+        {demo.OUTPUT_COUNT, demo.OUTPUT_GRID, demo.OUTPUT_PEAKS},
+        image_keys=[key], exemplars=demo.scale_exemplars(boxes, width), shot_num=len(boxes),
+    )
+    result = results[0]
+    return {
+        "count": result[demo.OUTPUT_COUNT],
+        "gridmap": demo.subgrid_counts_with_error(result[demo.OUTPUT_GRID]),
+        "cluster_centers": peak_codec.encode_peaks(result[demo.OUTPUT_PEAKS], encoding),
+    }
+
+
+@router.get("/model_cache_stats/")
+async def cache_stats(user_id: int = Depends(get_current_user)):
+    """Hit/miss counters and occupancy of the shared BirdCount result cache."""
+    return result_cache.stats()
+
+
+@router.get("/model_queue_stats/")
+async def queue_stats(user_id: int = Depends(get_current_user)):
+    """Batch sizes, queue wait and throughput of the shared inference queue."""
+    return inference_queue.stats()
+
+
+@router.get("/model_status/")
+async def model_status():
+    """Readiness of the counting model; it loads lazily or on a background warm-up thread."""
+    return counting_engine.status()
+
+
 def split_image(image, grid_size=(3, 3)):
     """Splits an image into a 3×3 grid without losing any pixels."""
     width, height = image.size
@@ -150,6 +351,31 @@ def split_image(image, grid_size=(3, 3)):
 
     return sub_images, sub_coords, (width, height)
 
+def run_tiles_cached(file: UploadFile = File(...), outputs=demo.ALL_OUTPUTS, include_full: bool = False):
+    """
+    Runs the 3×3 tiles of an upload (and optionally the full image) through the
+    counting model as one batch. Each tile and the full image are cached
+    separately, so only what is missing from the cache is computed.
+    """
+    file.file.seek(0)
+    data = file.file.read()
+    key = content_hash(data)
+    keys = [f"{key}:tile{i}" for i in range(9)]
+    if include_full:
+        keys.append(key)
+
+    tiles = []
+    def load_image(i):
+        if i == 9:
+            return data
+        if not tiles:
+            image = Image.open(io.BytesIO(data)).convert("RGB")
+            tiles.extend(split_image(image)[0])
+        return tiles[i]
+
+    results = cached_count_results(keys, load_image, outputs)
+    return results[:9], (results[9] if include_full else None)
+
 @router.post("/split-image/")
 async def split_and_return_images(file: UploadFile = File(...)):
     """Splits an image into a 3×3 grid and returns them as separate image responses."""
@@ -160,14 +386,9 @@ async def split_and_return_images(file: UploadFile = File(...)):
         print(sub_image.size)
     
 
-    count, elapsed_time, heatmap_tensor, cluster_centers, _, _, _, _ = demo.run_demo_image_nomongo(sub_images[0])
+    count, elapsed_time, heatmap_overlay, cluster_centers, _, _, _, _ = await run_in_threadpool(demo.run_demo_image_nomongo, sub_images[0], outputs={demo.OUTPUT_OVERLAY})
     
-    to_pil = transforms.ToPILImage()
-    image = to_pil(heatmap_tensor)
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    buffer.seek(0)
-    return Response(content=buffer.getvalue(), media_type="image/png")
+    return heatmap_response(heatmap_overlay, "png")
         
 
 
@@ -208,42 +429,28 @@ def scale_cluster_points(cluster_centers, grid_size=(3, 3)):
 
 
 @router.post("/model_combined_heatmap/")
-async def predict(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
+async def predict(
+    file: UploadFile = File(...),
+    image_format: str = Query(None, alias="format", description="png (default), jpeg or webp"),
+    user_id: int = Depends(get_current_user),
+):
     """Splits an image, processes 3×3 sub-images, and merges the heatmap and cluster points."""
-    image = Image.open(file.file)
-    sub_images, sub_coords, full_size = split_image(image)
+    image_format = heatmap_format(image_format)
+    tile_results, _ = await run_in_threadpool(run_tiles_cached, file, {demo.OUTPUT_OVERLAY})
 
-    heatmaps = []
-    
-    for sub_image in sub_images:
-        count, elapsed_time, heatmap_tensor, cluster_centers, _, _, _, _ = demo.run_demo_image_nomongo(sub_image)
-        to_pil = transforms.ToPILImage()
-        # Convert tensor to PIL Image
-        heatmap = to_pil(heatmap_tensor)
-
-        heatmaps.append(heatmap)
+    heatmaps = [Image.fromarray(result[demo.OUTPUT_OVERLAY]) for result in tile_results]
 
     # Merge heatmaps and rescale cluster points
     final_heatmap = merge_heatmaps(heatmaps)
 
-    # Convert final heatmap to response
-    buffer = io.BytesIO()
-    final_heatmap.save(buffer, format="PNG")
-    buffer.seek(0)
-    
-    return Response(content=buffer.getvalue(), media_type="image/png")
+    return heatmap_response(final_heatmap, image_format)
 
 @router.post("/model_combined_cluster/")
 async def predict(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
     """Splits an image, processes 3×3 sub-images, and merges the heatmap and cluster points."""
-    image = Image.open(file.file)
-    sub_images, sub_coords, full_size = split_image(image)
+    tile_results, _ = await run_in_threadpool(run_tiles_cached, file, {demo.OUTPUT_PEAKS})
 
-    cluster_points = []
-    
-    for sub_image in sub_images:
-        count, elapsed_time, heatmap_tensor, cluster_centers, _, _, _, _ = demo.run_demo_image_nomongo(sub_image)
-        cluster_points.append(cluster_centers)
+    cluster_points = [peak_codec.encode_peaks(result[demo.OUTPUT_PEAKS]) for result in tile_results]
 
     # Merge heatmaps and rescale cluster points
     final_cluster_points = scale_cluster_points(cluster_points)
@@ -254,14 +461,9 @@ async def predict(file: UploadFile = File(...), user_id: int = Depends(get_curre
 @router.post("/model_combined_count/")
 async def predict(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
     """Splits an image, processes 3×3 sub-images, and merges the heatmap and cluster points."""
-    image = Image.open(file.file)
-    sub_images, sub_coords, full_size = split_image(image)
+    tile_results, _ = await run_in_threadpool(run_tiles_cached, file, {demo.OUTPUT_COUNT})
 
-    Count=0
-    
-    for sub_image in sub_images:
-        count, elapsed_time, heatmap_tensor, cluster_centers, _, _, pred_cnt_flt, _ = demo.run_demo_image_nomongo(sub_image)
-        Count+=pred_cnt_flt
+    Count = sum(result[demo.OUTPUT_COUNT] for result in tile_results)
 
     return Count
 
@@ -269,19 +471,74 @@ async def predict(file: UploadFile = File(...), user_id: int = Depends(get_curre
 @router.post("/model_combined_gridmap/")
 async def predict(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
     """Splits an image, processes 3×3 sub-images, and merges the heatmap and cluster points."""
-    image = Image.open(file.file)
-    sub_images, sub_coords, full_size = split_image(image)
+    tile_results, _ = await run_in_threadpool(run_tiles_cached, file, {demo.OUTPUT_COUNT})
 
     Gridmap=[]
     
-    for sub_image in sub_images:
-        count, elapsed_time, heatmap_tensor, cluster_centers, _, _, pred_cnt_flt, _ = demo.run_demo_image_nomongo(sub_image)
+    for result in tile_results:
+        pred_cnt_flt = result[demo.OUTPUT_COUNT]
         decimal_part, integer_part = math.modf(pred_cnt_flt)
         Gridmap.append([integer_part,decimal_part])
 
     return Gridmap
 
 
+def run_tiled_cached(file: UploadFile, tile_scale=None, source_gsd=None, target_gsd=None, overlap=tiling.TILE_OVERLAP):
+    """Counts an upload through the overlapping tile engine; results are cached per tiling configuration."""
+    file.file.seek(0)
+    data = file.file.read()
+    tile_w, tile_h = tiling.tile_size(tile_scale, source_gsd, target_gsd)
+    key = f"{content_hash(data)}:tiled:{tile_w}x{tile_h}:{overlap}"
+
+    def compute():
+        try:
+            return tiling.count_tiled(Image.open(io.BytesIO(data)), tile_w, tile_h, overlap)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return data, result_cache.get_or_compute(key, compute)
+
+
+@router.post("/model_tiled_count/")
+async def predict(
+    file: UploadFile = File(...),
+    tile_scale: float = Query(None, gt=0, description="Source pixels per model pixel (default BIRDCOUNT_TILE_SCALE)"),
+    source_gsd: float = Query(None, gt=0, description="Ground-sample distance of the image, e.g. cm/pixel"),
+    target_gsd: float = Query(None, gt=0, description="Ground-sample distance the model should see, same unit"),
+    overlap: float = Query(tiling.TILE_OVERLAP, ge=0, lt=0.5),
+    encoding: str = Query(None, alias="peaks_format", description=PEAKS_FORMAT_DESCRIPTION),
+    user_id: int = Depends(get_current_user),
+):
+    """Counts a large image with overlapping N×M tiles; cluster points are in full-image pixels."""
+    encoding = peaks_format(encoding)
+    _, result = await run_in_threadpool(run_tiled_cached, file, tile_scale, source_gsd, target_gsd, overlap)
+    return {
+        "count": result["count"],
+        "cluster_centers": peak_codec.encode_peaks(result["peaks"], encoding),
+        "tile_counts": result["tile_counts"],
+        "grid": result["grid"],
+    }
+
+
+@router.post("/model_tiled_heatmap/")
+async def predict(
+    file: UploadFile = File(...),
+    tile_scale: float = Query(None, gt=0),
+    source_gsd: float = Query(None, gt=0),
+    target_gsd: float = Query(None, gt=0),
+    overlap: float = Query(tiling.TILE_OVERLAP, ge=0, lt=0.5),
+    image_format: str = Query(None, alias="format", description="png (default), jpeg or webp"),
+    user_id: int = Depends(get_current_user),
+):
+    """Blended tile density over the image, at model scale (one model pixel per `tile_scale` source pixels)."""
+    image_format = heatmap_format(image_format)
+    data, result = await run_in_threadpool(run_tiled_cached, file, tile_scale, source_gsd, target_gsd, overlap)
+    density = result["density"]
+    image = Image.open(io.BytesIO(data)).convert("RGB").resize((density.shape[1], density.shape[0]))
+    overlay = render.render_overlay(transforms.ToTensor()(image), density)
+    return heatmap_response(overlay, image_format)
+
+
 
 import io
 import cv2
@@ -336,23 +593,20 @@ def combine_heatmaps(single_heatmap, grid_heatmap, weight_single=0.4, weight_gri
 
 
 @router.post("/model_final_heatmap/")
-async def predict(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
+async def predict(
+    file: UploadFile = File(...),
+    image_format: str = Query(None, alias="format", description="png (default), jpeg or webp"),
+    user_id: int = Depends(get_current_user),
+):
     """Processes both full image and 3×3 sub-images, and combines their heatmaps probabilistically."""
+    image_format = heatmap_format(image_format)
     
-    image = Image.open(file.file)
-    # 1. Get heatmap from the full image
-    single_heatmap_tensor = helper_get_heatmap(file)
-    to_pil = transforms.ToPILImage()
-    single_heatmap = to_pil(single_heatmap_tensor)  # Convert tensor to PIL image
+    # 1. Get heatmaps from the full image and the split images in one batch
+    tile_results, full_result = await run_in_threadpool(run_tiles_cached, file, {demo.OUTPUT_OVERLAY}, include_full=True)
+    single_heatmap = Image.fromarray(full_result[demo.OUTPUT_OVERLAY])
     
-    # 2. Get heatmap from the split images
-    sub_images, sub_coords, full_size = split_image(image)
-    heatmaps = []
-
-    for sub_image in sub_images:
-        _, _, heatmap_tensor, _, _, _, _, _ = demo.run_demo_image_nomongo(sub_image)
-        heatmap = to_pil(heatmap_tensor)  # Convert tensor to PIL Image
-        heatmaps.append(heatmap)
+    # 2. Convert the split-image heatmaps
+    heatmaps = [Image.fromarray(result[demo.OUTPUT_OVERLAY]) for result in tile_results]
 
     # 3. Merge the split-image heatmaps
     merged_grid_heatmap = merge_heatmaps(heatmaps)
@@ -360,40 +614,11 @@ async def predict(file: UploadFile = File(...), user_id: int = Depends(get_curre
     # 4. Combine both heatmaps probabilistically
     final_heatmap = combine_heatmaps(single_heatmap, merged_grid_heatmap, weight_single=0.4, weight_grid=0.6, threshold=0.3)
 
-    # 5. Convert final heatmap to response
-    buffer = io.BytesIO()
-    final_heatmap.save(buffer, format="PNG")
-    buffer.seek(0)
-
-    return Response(content=buffer.getvalue(), media_type="image/png")
-
-
+    # 5. Encode the final heatmap once
+    return heatmap_response(final_heatmap, image_format)
 
 
-def detect_local_maxima(density_map, threshold, min_distance=3):
-    """
-    Detects local maxima in the density map to identify individual bird locations.
-    
-    Args:
-        density_map (torch.Tensor or np.ndarray): The density map of bird locations.
-        threshold (float): The minimum density value to consider a point as a bird.
-        min_distance (int): The minimum distance between two detected peaks.
-    
-    Returns:
-        List[dict]: A list of dictionaries containing 'x' and 'y' coordinates of detected birds.
-    """
-    # Convert tensor to numpy array if needed
-    if hasattr(density_map, 'cpu'):
-        density_map = density_map.cpu().numpy()
 
-    # Apply threshold
-    mask = density_map > threshold
-
-    # Find local maxima using a maximum filter
-    local_max = (density_map == ndimage.maximum_filter(density_map, size=min_distance)) & mask
-    y, x = np.where(local_max)  # Extract coordinates
-
-    return [{'x': int(x[i]), 'y': int(y[i])} for i in range(len(x))]
 
 def count_birds_from_heatmap(combined_heatmap, threshold=0.54, min_distance=3):
     """
@@ -418,7 +643,7 @@ def count_birds_from_heatmap(combined_heatmap, threshold=0.54, min_distance=3):
     heatmap_array /= 255.0
 
     # Detect local maxima (bird locations)
-    detected_birds = detect_local_maxima(heatmap_array, threshold, min_distance)
+    detected_birds = peak_codec.encode_peaks(peak_codec.find_peaks(heatmap_array, threshold, min_distance))
 
     return len(detected_birds), detected_birds
 
@@ -428,20 +653,12 @@ def count_birds_from_heatmap(combined_heatmap, threshold=0.54, min_distance=3):
 async def predict(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
     """Processes both full image and 3×3 sub-images, and combines their heatmaps probabilistically."""
     
-    image = Image.open(file.file)
-    # 1. Get heatmap from the full image
-    single_heatmap_tensor = helper_get_heatmap(file)
-    to_pil = transforms.ToPILImage()
-    single_heatmap = to_pil(single_heatmap_tensor)  # Convert tensor to PIL image
+    # 1. Get heatmaps from the full image and the split images in one batch
+    tile_results, full_result = await run_in_threadpool(run_tiles_cached, file, {demo.OUTPUT_OVERLAY}, include_full=True)
+    single_heatmap = Image.fromarray(full_result[demo.OUTPUT_OVERLAY])
     
-    # 2. Get heatmap from the split images
-    sub_images, sub_coords, full_size = split_image(image)
-    heatmaps = []
-
-    for sub_image in sub_images:
-        _, _, heatmap_tensor, _, _, _, _, _ = demo.run_demo_image_nomongo(sub_image)
-        heatmap = to_pil(heatmap_tensor)  # Convert tensor to PIL Image
-        heatmaps.append(heatmap)
+    # 2. Convert the split-image heatmaps
+    heatmaps = [Image.fromarray(result[demo.OUTPUT_OVERLAY]) for result in tile_results]
 
     # 3. Merge the split-image heatmaps
     merged_grid_heatmap = merge_heatmaps(heatmaps)
@@ -0,0 +1,83 @@
+import numpy as np
+
+from BirdCount.model_files.peaks import pack_peaks, unpack_peaks, decode_peaks
+
+# BirdCount point annotations live in annotations.points as packed little-endian
+# (x, y) pairs (int16, or int32 when a coordinate needs it; see pack_peaks).
+# Rows written before that keep their JSON in cluster_centers until they are
+# next edited: reads only decode them, and every write path stores packed points.
+
+
+def as_points(payload):
+    """[{"x": .., "y": ..}, ...] from a request as [N, 2] int32 points, rounded to whole pixels."""
+    return decode_peaks(list(payload or []))
+
+
+def packed_row(points):
+    """(points, points_encoding, point_count) column values for an INSERT."""
+    data, width = pack_peaks(points)
+    return data, width, len(points)
+
+
+def insert_points(cur, image_id, width, height, points):
+    data, encoding, count = packed_row(points)
+    cur.execute(
+        """
+        INSERT INTO annotations (image_id, width, height, points, points_encoding, point_count)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        RETURNING id
+        """,
+        (image_id, width, height, data, encoding, count)
+    )
+    return cur.fetchone()[0]
+
+
+def update_points(cur, annotation_id, points):
+    data, encoding, count = packed_row(points)
+    cur.execute(
+        """
+        UPDATE annotations
+        SET points = %s, points_encoding = %s, point_count = %s, cluster_centers = NULL
+        WHERE id = %s
+        """,
+        (data, encoding, count, annotation_id)
+    )
+
+
+def load_points(cur, image_id, for_update=False):
+    """
+    Latest annotation of an image as (annotation_id, width, height, [N, 2]
+    points), or None if it has none. Rows still holding JSON are decoded but
+    not rewritten, so reads never write.
+    """
+    cur.execute(
+        """
+        SELECT id, width, height, points, points_encoding, cluster_centers FROM annotations
+        WHERE image_id = %s ORDER BY id DESC LIMIT 1
+        """ + (" FOR UPDATE" if for_update else ""),
+        (image_id,)
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    if row["points"] is not None:
+        points = unpack_peaks(row["points"], row["points_encoding"])
+    else:
+        points = decode_peaks(row["cluster_centers"] or [])
+    return row["id"], row["width"], row["height"], points
+
+
+def apply_delta(points, add, remove):
+    """
+    Drops every point equal to one in `remove`, then appends `add`.
+    Returns (new points, number removed).
+    """
+    if len(remove) and len(points):
+        keys = points[:, 0].astype(np.int64) << 32 | (points[:, 1].astype(np.int64) & 0xFFFFFFFF)
+        drop = remove[:, 0].astype(np.int64) << 32 | (remove[:, 1].astype(np.int64) & 0xFFFFFFFF)
+        keep = ~np.isin(keys, drop)
+        removed = int(len(points) - keep.sum())
+        points = points[keep]
+    else:
+        removed = 0
+    return np.concatenate([points.reshape(-1, 2), add.reshape(-1, 2)]).astype(np.int32), removed
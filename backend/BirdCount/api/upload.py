@@ -1,18 +1,24 @@
-import json
 import os
 import uuid
-import time
 from zipfile import ZipFile
 from typing import List
+import psycopg2
 from fastapi import HTTPException, File, UploadFile, Form, Request, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from PIL import Image
 
 from Common.shared_utils import logger, UPLOAD_DIR, get_db_connection, get_model, MODEL_TYPE_BIRD_COUNT
 from Common.api.auth import get_current_user
 
 import BirdCount.model_files.demomodified as demo
+from BirdCount.model_files import density_store
+from BirdCount.model_files.peaks import scale_peaks
+from BirdCount.api import point_store
+from BirdCount.api.folder_pipeline import FolderCountPipeline, archive_images
 
 MAX_FILE_SIZE = 1 * 1024**3  # 1 GB
+UPLOAD_CHUNK_SIZE = 1024**2
 
 async def upload_folders_bird_count(
     request: Request,
@@ -21,107 +27,68 @@ async def upload_folders_bird_count(
     user_id: int = Depends(get_current_user),      
     consent: bool = Form(False),
 ):
-    uploaded_image_ids = []
-    for folder in folders:
-        if not any(folder.filename.lower().endswith(ext) for ext in ('.zip', '.rar', '.tar', '.gz', '.bz2', '.7z')):
-            raise HTTPException(status_code=400, detail="Only ZIP, RAR, TAR, GZ, BZ2, and 7Z files are allowed")
-
-        content = await folder.read()
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail="Uploaded file exceeds the 1GB size limit")
-
-        temp_zip_path = os.path.join(UPLOAD_DIR, f"temp_{int(time.time())}.zip")
-        try:
+    archives = []
+    try:
+        for folder in folders:
+            if not any(folder.filename.lower().endswith(ext) for ext in ('.zip', '.rar', '.tar', '.gz', '.bz2', '.7z')):
+                raise HTTPException(status_code=400, detail="Only ZIP, RAR, TAR, GZ, BZ2, and 7Z files are allowed")
+
+            # Spool the archive to disk in chunks instead of holding it in memory
+            temp_zip_path = os.path.join(UPLOAD_DIR, f"temp_{uuid.uuid4()}.zip")
+            archives.append((temp_zip_path, []))
+            size = 0
             with open(temp_zip_path, "wb") as buffer:
-                buffer.write(content)
+                while chunk := await folder.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_FILE_SIZE:
+                        raise HTTPException(status_code=400, detail="Uploaded file exceeds the 1GB size limit")
+                    buffer.write(chunk)
 
             with ZipFile(temp_zip_path) as zip_ref:
                 total_uncompressed = sum(info.file_size for info in zip_ref.infolist())
                 if total_uncompressed > MAX_FILE_SIZE:
                     raise HTTPException(status_code=400, detail="Uncompressed content exceeds the 1GB limit")
+            archives[-1] = (temp_zip_path, archive_images(temp_zip_path))
 
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    with ZipFile(temp_zip_path) as zip_ref:
-                        for file_info in zip_ref.filelist:
-                            if file_info.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                                original_filename = os.path.basename(file_info.filename)
-                                unique_filename = f"{uuid.uuid4()}_{original_filename}"
-                                file_path = os.path.join(UPLOAD_DIR, unique_filename)
-
-                                with zip_ref.open(file_info) as zip_file:
-                                    with open(file_path, 'wb') as target:
-                                        target.write(zip_file.read())
-
-                                img = Image.open(file_path)
-                                width, height = img.size
-
-                                cur.execute(
-                                    """
-                                    INSERT INTO images (filename, filepath, width, height, user_id, model_type, consent) 
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s) 
-                                    RETURNING id
-                                    """,
-                                    (unique_filename, file_path, width, height, user_id, MODEL_TYPE_BIRD_COUNT, consent)
-                                )
-                                image_id = cur.fetchone()[0]
-                                uploaded_image_ids.append(image_id)
-
-                                try:
-                                    image = Image.open(file_path)
-                                    original_tensor_size = (480, 384)  # Tensor size (width, height)
-                                    target_image_size = image.size  # Actual image size (width, height)
-                                    count, elapsed_time, heatmap_file, cluster_centers, image_dimensions, subgrid_counts, pred_cnt_flt, subgridcounts_error = demo.run_demo_image_nomongo(image)
-                                    scaled_cluster_centers = scale_coordinates(cluster_centers[3], original_tensor_size, target_image_size)
-                                    target_width, target_height = target_image_size
-                                    cluster_centers_json = json.dumps(scaled_cluster_centers)
-                                    cur.execute(
-                                        """
-                                        INSERT INTO annotations (image_id, width, height, cluster_centers) 
-                                        VALUES (%s, %s, %s, %s)
-                                        """,
-                                        (
-                                            image_id,                    
-                                            target_width,
-                                            target_height,
-                                            cluster_centers_json
-                                        )
-                                    )
-                                except Exception as infer_err:
-                                    logger.error(f"Inference error for image {image_id}: {infer_err}")
-
-                conn.commit()
-
-        except HTTPException as http_err:
-            raise http_err
-        except Exception as e:
-            logger.error(f"Folder upload error: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
-
-        finally:
+    except Exception as e:
+        for temp_zip_path, _ in archives:
             if os.path.exists(temp_zip_path):
                 os.remove(temp_zip_path)
-
-    return {
-        "message": "Folders uploaded successfully",
-        "uploaded_image_ids": uploaded_image_ids
-    }
+        if isinstance(e, HTTPException):
+            raise e
+        logger.error(f"Folder upload error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Extraction, decoding, counting and DB writes run as a pipeline; progress streams as SSE
+    pipeline = FolderCountPipeline(archives, user_id, consent)
+    return StreamingResponse(
+        pipeline.events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
     
 
-def scale_coordinates(cluster_centers, original_size, target_size):
-    tensor_width, tensor_height = original_size
-    target_width, target_height = target_size
+def predict_image(file_path):
+    """Counts an uploaded image: peaks, raw density map and count."""
+    return demo.count_images_nomongo([file_path], {demo.OUTPUT_PEAKS, demo.OUTPUT_DENSITY, demo.OUTPUT_COUNT})[0]
 
-    scale_x = 480 / tensor_width
-    scale_y = 384 / tensor_height
-
-    # Flatten the list of lists and scale each point
-    scaled_points = [
-        {"x": int(point["x"] * scale_x), "y": int(point["y"] * scale_y)}
-        for point in cluster_centers
-    ]
-    return scaled_points
 
+def store_predictions(cur, image_id, image_size, result):
+    """
+    Inserts the peaks of a counted image as its initial annotations and keeps
+    the raw density map so peaks can be re-extracted later without the model.
+    """
+    original_tensor_size = (480, 384)  # Tensor size (width, height)
+    density_store.save_density(cur, image_id, result[demo.OUTPUT_DENSITY])
+    # Annotations keep the 480x384 model frame; the image size is stored alongside them
+    target_width, target_height = image_size
+    point_store.insert_points(cur, image_id, target_width, target_height,
+                              scale_peaks(result[demo.OUTPUT_PEAKS], original_tensor_size, (480, 384)))
+    # Kept on the image so listings show the count without touching the density map
+    cur.execute("UPDATE images SET predicted_count = %s WHERE id = %s", (result[demo.OUTPUT_COUNT], image_id))
 
 
 async def upload_images_bird_count(
@@ -159,29 +126,21 @@ async def upload_images_bird_count(
                     uploaded_ids.append(image_id)
                     
                     try:
-                        #cluster_centers=helper_get_cluster1(file)
-                        image = Image.open(file_path)
-                        original_tensor_size = (480, 384)  # Tensor size (width, height)
-                        target_image_size = image.size  # Actual image size (width, height)
-                        count, elapsed_time, heatmap_file, cluster_centers, image_dimensions, subgrid_counts, pred_cnt_flt, subgridcounts_error = demo.run_demo_image_nomongo(image)
-                        scaled_cluster_centers = scale_coordinates(cluster_centers[3], original_tensor_size, target_image_size)
-                        target_width, target_height = target_image_size
-                        cluster_centers_json = json.dumps(scaled_cluster_centers)
-                        cur.execute(
-                            """
-                            INSERT INTO annotations (image_id, width, height, cluster_centers) 
-                            VALUES (%s, %s, %s, %s)
-                            """,
-                            (
-                                image_id,                    
-                                target_width,
-                                target_height,
-                                cluster_centers_json
-                            )
-                        )
+                        result = await run_in_threadpool(predict_image, file_path)
                     except Exception as infer_err:
                         logger.error(f"Inference error for image {image_id}: {infer_err}")
-                        
+                        continue
+
+                    # A failed write only rolls back this image's predictions; without the
+                    # savepoint it would abort the transaction and lose every image in the upload
+                    cur.execute("SAVEPOINT predictions")
+                    try:
+                        store_predictions(cur, image_id, (width, height), result)
+                        cur.execute("RELEASE SAVEPOINT predictions")
+                    except psycopg2.Error as db_err:
+                        cur.execute("ROLLBACK TO SAVEPOINT predictions")
+                        logger.error(f"Could not store predictions for image {image_id}: {db_err}")
+
                 conn.commit()
                 return {"uploaded_image_ids": uploaded_ids, "user_id": user_id}
     except Exception as e:
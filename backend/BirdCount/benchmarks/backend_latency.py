@@ -0,0 +1,51 @@
+"""
+CPU latency of the BirdCount counter per backend: eager PyTorch against the
+ONNX Runtime and TorchScript graphs written by BirdCount.model_files.export.
+
+Usage (from backend/):
+    python -m BirdCount.model_files.export
+    python -m BirdCount.benchmarks.backend_latency --runs 10 --threads 4
+"""
+
+import argparse
+
+import torch
+
+from BirdCount.model_files.engine import CountingEngine
+from BirdCount.model_files.demomodified import predict_density_maps
+from BirdCount.benchmarks.fixtures import synthetic_image
+from BirdCount.benchmarks.device_latency import prepare, time_runs
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=['eager', 'onnx', 'torchscript'])
+    parser.add_argument('--threads', type=int, default=0, help='CPU intra-op threads, 0 = one per physical core')
+    parser.add_argument('--runs', type=int, default=10, help='timed runs per backend')
+    parser.add_argument('--width', type=int, default=1600, help='synthetic image width')
+    parser.add_argument('--height', type=int, default=1200, help='synthetic image height')
+    return parser.parse_args()
+
+
+def main(opt):
+    image = synthetic_image(opt.width, opt.height)
+    device = torch.device('cpu')
+    baseline = None
+
+    print(f"{'backend':<12}{'p50 ms':>10}{'p95 ms':>10}{'vs eager':>10}{'count':>10}")
+    for backend in opt.backends:
+        engine = CountingEngine(device=device, num_threads=opt.threads, backend=backend)
+        if engine.backend != backend:
+            print(f"{backend:<12}{'unavailable, run BirdCount.model_files.export first':>52}")
+            continue
+        samples, boxes = prepare(image, device)
+        p50, p95 = time_runs(lambda: predict_density_maps(engine.model, samples, boxes), opt.runs, device)
+        count = predict_density_maps(engine.model, samples, boxes).sum().item() / 60
+        baseline = baseline or (p50 if backend == 'eager' else None)
+        speedup = f"{baseline / p50:.2f}x" if baseline else '-'
+        print(f"{backend:<12}{p50:>10.1f}{p95:>10.1f}{speedup:>10}{count:>10.2f}")
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
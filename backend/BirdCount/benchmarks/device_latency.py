@@ -0,0 +1,85 @@
+"""
+Per-image counting latency of the BirdCount engine on each available device.
+
+Compares the batched engine against the legacy path (one window per forward
+call, exemplars projected for every window) at the same thread count.
+
+Usage (from backend/):
+    python -m BirdCount.benchmarks.device_latency --runs 10
+    python -m BirdCount.benchmarks.device_latency --devices cpu --threads 1 4 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from BirdCount.model_files.engine import CountingEngine
+from BirdCount.model_files.demomodified import predict_density_maps, window_offsets, WINDOW_SIZE
+from BirdCount.model_files.preprocess import preprocess_image
+from BirdCount.benchmarks.fixtures import synthetic_image
+
+
+def prepare(image, device):
+    samples, boxes, _ = preprocess_image(image)
+    return samples.unsqueeze(0).to(device), boxes.unsqueeze(0).to(device)
+
+
+def legacy_density_map(model, samples, boxes):
+    """Window-at-a-time loop equivalent to the pre-engine run_one_image_nomongo."""
+    _, _, h, w = samples.shape
+    density = torch.zeros([h, w], device=samples.device)
+    coverage = torch.zeros([w], device=samples.device)
+    with torch.no_grad():
+        for start in window_offsets(w):
+            output = model(samples[:, :, :, start:start + WINDOW_SIZE], boxes, 3)
+            density[:, start:start + WINDOW_SIZE] += output[0]
+            coverage[start:start + WINDOW_SIZE] += 1
+    return density / coverage.clamp(min=1)
+
+
+def time_runs(fn, runs, device):
+    fn()  # warm-up
+    timings = []
+    for _ in range(runs):
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        fn()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        timings.append(time.perf_counter() - start)
+    return np.percentile(timings, 50) * 1000, np.percentile(timings, 95) * 1000
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', nargs='+', default=None, help='devices to benchmark, i.e. cpu cuda (default: all available)')
+    parser.add_argument('--threads', nargs='+', type=int, default=[0], help='CPU intra-op thread counts, 0 = one per physical core')
+    parser.add_argument('--runs', type=int, default=10, help='timed runs per configuration')
+    parser.add_argument('--width', type=int, default=1600, help='synthetic image width')
+    parser.add_argument('--height', type=int, default=1200, help='synthetic image height')
+    return parser.parse_args()
+
+
+def main(opt):
+    devices = opt.devices or (['cpu', 'cuda'] if torch.cuda.is_available() else ['cpu'])
+    image = synthetic_image(opt.width, opt.height)
+
+    print(f"{'device':<8}{'threads':>8}{'path':>10}{'p50 ms':>12}{'p95 ms':>12}")
+    for name in devices:
+        for threads in (opt.threads if name == 'cpu' else [None]):
+            engine = CountingEngine(device=name, num_threads=threads)
+            samples, boxes = prepare(image, engine.device)
+
+            p50, p95 = time_runs(lambda: predict_density_maps(engine.model, samples, boxes), opt.runs, engine.device)
+            print(f"{name:<8}{str(engine.num_threads or '-'):>8}{'engine':>10}{p50:>12.1f}{p95:>12.1f}")
+
+            p50, p95 = time_runs(lambda: legacy_density_map(engine.model, samples, boxes), opt.runs, engine.device)
+            print(f"{name:<8}{str(engine.num_threads or '-'):>8}{'legacy':>10}{p50:>12.1f}{p95:>12.1f}")
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,44 @@
+"""Seeded test images and memory helpers shared by the BirdCount benchmarks (and export's parity check)."""
+
+import io
+import resource
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_image(width=1600, height=1200, seed=0, birds=0):
+    """
+    Seeded RGB image. With birds=0 it is uniform noise; otherwise a noisy light
+    background with `birds` small dark discs, roughly what a flock photo gives
+    the counter.
+    """
+    rng = np.random.default_rng(seed)
+    if not birds:
+        return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    pixels = rng.normal(170, 20, (height, width, 3))
+    radius = max(min(width, height) // 150, 4)
+    for _ in range(birds):
+        cx, cy, r = rng.integers(0, width), rng.integers(0, height), rng.integers(radius, 2 * radius + 1)
+        y0, y1, x0, x1 = max(cy - r, 0), min(cy + r + 1, height), max(cx - r, 0), min(cx + r + 1, width)
+        ys, xs = np.ogrid[y0:y1, x0:x1]
+        pixels[y0:y1, x0:x1][(xs - cx) ** 2 + (ys - cy) ** 2 <= r * r] = rng.normal(40, 10, 3)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def synthetic_jpeg(width, height, seed=0, birds=200, quality=90):
+    """synthetic_image with birds, JPEG-encoded so decoding is part of what gets measured."""
+    buffer = io.BytesIO()
+    synthetic_image(width, height, seed, birds).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def fixture_images(n=8, width=1200, height=900, seed=0):
+    """`n` seeded images with 20-200 birds each, for accuracy comparisons."""
+    rng = np.random.default_rng(seed)
+    return [synthetic_image(width, height, seed + i, birds=int(rng.integers(20, 200))) for i in range(n)]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
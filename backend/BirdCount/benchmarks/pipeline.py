@@ -0,0 +1,206 @@
+"""
+End-to-end BirdCount pipeline benchmark with per-stage timing.
+
+Runs JPEG-encoded images of several sizes through the same calls the
+endpoints make:
+    single  run_demo_image_nomongo + heatmap encode (/model_heatmap/, /model_count/, ...)
+    tiled   tiling.count_tiled + overlay encode (/model_tiled_count/, /model_tiled_heatmap/)
+and reports p50/p95 per stage (decode, resize, exemplar_crops, encoder,
+decoder, peaks, grid, overlay, encode, tile_* ...), throughput and peak
+memory. `--model stub` replaces the counter with a weightless stand-in so
+everything around the model can be profiled anywhere, without a checkpoint.
+
+With BIRDCOUNT_BATCHING on (the default, as in production) the model runs on
+the inference queue's worker thread; its stages are merged back into the
+caller's timings, plus 'queue_wait' for the time spent waiting for a batch.
+
+Usage (from backend/):
+    python -m BirdCount.benchmarks.pipeline --model stub --sizes 640x480 1600x1200 4000x3000
+    python -m BirdCount.benchmarks.pipeline --model real --json results.json
+    python -m BirdCount.benchmarks.pipeline --model stub --baseline results.json --tolerance 0.2
+"""
+
+import argparse
+import io
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision.transforms.functional as TF
+from PIL import Image
+
+import BirdCount.model_files.demomodified as demo
+from BirdCount.model_files import engine as counting_engine
+from BirdCount.model_files import render, stage_timer, tiling
+from BirdCount.benchmarks.fixtures import synthetic_jpeg, peak_rss_mb
+
+
+class StubMAE:
+    """Stands in for SupervisedMAE: model-shaped outputs from image darkness, no weights."""
+
+    def exemplar_embeddings(self, boxes, shot_num=3):
+        return torch.zeros((len(boxes), max(shot_num, 1), 512), device=boxes.device)
+
+    def encoder_latents(self, imgs, keys=None):
+        darkness = 1 - imgs.mean(1, keepdim=True)
+        return F.avg_pool2d(darkness, 16).flatten(1)[..., None]  # [N, 576, 1]
+
+    def forward_decoder(self, x, y_, shot_num=3, exemplar_embeddings=None):
+        n, hw, _ = x.shape
+        h = w = int(math.sqrt(hw))
+        grid = x.transpose(1, 2).reshape(n, 1, h, w)
+        return F.interpolate(grid, scale_factor=16, mode='bilinear', align_corners=False)[:, 0].clamp(min=0) * 0.01
+
+    def __call__(self, imgs, boxes, shot_num, exemplar_embeddings=None):
+        return self.forward_decoder(self.encoder_latents(imgs), boxes, shot_num)
+
+
+class StubEngine:
+    def __init__(self, device):
+        self.device = device
+        self.model = StubMAE()
+        self.backend = 'stub'
+        self.quantized = False
+        self.num_threads = None
+        self.ready = True
+
+
+def run_single(data):
+    result = demo.run_demo_image_nomongo(data)
+    render.encode_image(result[2])
+
+
+def run_tiled(data):
+    result = tiling.count_tiled(Image.open(io.BytesIO(data)))
+    density = result['density']
+    with stage_timer.stage('overlay'):
+        image = Image.open(io.BytesIO(data)).convert('RGB').resize((density.shape[1], density.shape[0]))
+        overlay = render.render_overlay(TF.to_tensor(image), density)
+    render.encode_image(overlay)
+
+
+PATHS = {'single': run_single, 'tiled': run_tiled}
+
+
+def percentiles(values):
+    values = np.array(values) * 1000
+    return {'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95))}
+
+
+def benchmark(path, data, size, runs, warmup, device):
+    fn = PATHS[path]
+    for _ in range(warmup):
+        fn(data)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+    per_run = []
+    for _ in range(runs):
+        with stage_timer.collect(synchronize=device.type == 'cuda') as timings:
+            start = time.perf_counter()
+            fn(data)
+            total = time.perf_counter() - start
+        per_run.append(({name: sum(values) for name, values in timings.items()},
+                         {name: len(values) for name, values in timings.items()}, total))
+
+    names = sorted({name for stages, _, _ in per_run for name in stages})
+    totals = [total for _, _, total in per_run]
+    return {
+        'path': path,
+        'size': f"{size[0]}x{size[1]}",
+        'stages': {name: {**percentiles([stages.get(name, 0.0) for stages, _, _ in per_run]),
+                          'calls': per_run[0][1].get(name, 0)} for name in names},
+        'total': percentiles(totals),
+        'images_per_s': len(totals) / sum(totals),
+        'megapixels_per_s': len(totals) * size[0] * size[1] / 1e6 / sum(totals),
+        'peak_rss_mb': peak_rss_mb(),
+        'cuda_peak_mb': torch.cuda.max_memory_allocated(device) / 1e6 if device.type == 'cuda' else None,
+    }
+
+
+def print_result(r):
+    print(f"\n{r['path']} {r['size']}: total p50 {r['total']['p50_ms']:.1f} ms, p95 {r['total']['p95_ms']:.1f} ms, "
+          f"{r['images_per_s']:.2f} img/s, {r['megapixels_per_s']:.1f} MP/s, peak RSS {r['peak_rss_mb']:.0f} MB"
+          + (f", CUDA peak {r['cuda_peak_mb']:.0f} MB" if r['cuda_peak_mb'] is not None else ""))
+    print(f"  {'stage':<22}{'calls':>6}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, s in sorted(r['stages'].items(), key=lambda item: -item[1]['p50_ms']):
+        print(f"  {name:<22}{s['calls']:>6}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}")
+
+
+def regressions(results, baseline_path, tolerance):
+    """Configurations whose total p50 grew by more than `tolerance` against a previous --json file."""
+    baseline = {(r['path'], r['size']): r for r in json.loads(Path(baseline_path).read_text())['results']}
+    slower = []
+    for r in results:
+        old = baseline.get((r['path'], r['size']))
+        if old and r['total']['p50_ms'] > old['total']['p50_ms'] * (1 + tolerance):
+            slower.append(f"{r['path']} {r['size']}: {old['total']['p50_ms']:.1f} -> {r['total']['p50_ms']:.1f} ms")
+    return slower
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=['stub', 'real'], default='stub', help='weightless stand-in or the real checkpoint')
+    parser.add_argument('--device', default=None, help='cpu, cuda, ... (default: the engine default)')
+    parser.add_argument('--paths', nargs='+', choices=list(PATHS), default=list(PATHS))
+    parser.add_argument('--sizes', nargs='+', default=['640x480', '1600x1200', '4000x3000'], help='synthetic image sizes, WxH')
+    parser.add_argument('--images', default=None, help='folder of fixture photos to run instead of synthetic ones')
+    parser.add_argument('--runs', type=int, default=10, help='timed runs per configuration')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed runs per configuration')
+    parser.add_argument('--json', default=None, help='write machine-readable results here')
+    parser.add_argument('--baseline', default=None, help='earlier --json results to compare total p50 against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p50 slowdown vs the baseline (0.2 = 20%%)')
+    return parser.parse_args()
+
+
+def main(opt):
+    if opt.model == 'stub':
+        counting_engine._engine = StubEngine(counting_engine.select_device(opt.device or counting_engine.DEVICE))
+    else:
+        counting_engine._engine = counting_engine.CountingEngine(device=opt.device)
+        counting_engine._engine.warm_up()
+    device = counting_engine.get_engine().device
+
+    if opt.images:
+        paths = sorted(p for p in Path(opt.images).iterdir() if p.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+        inputs = [(p.read_bytes(), Image.open(p).size) for p in paths]
+    else:
+        sizes = [tuple(int(v) for v in size.lower().split('x')) for size in opt.sizes]
+        inputs = [(synthetic_jpeg(w, h, seed=i), (w, h)) for i, (w, h) in enumerate(sizes)]
+
+    results = []
+    for path in opt.paths:
+        for data, size in inputs:
+            results.append(benchmark(path, data, size, opt.runs, opt.warmup, device))
+            print_result(results[-1])
+
+    report = {
+        'meta': {
+            'model': opt.model,
+            'device': str(device),
+            'batching': demo.BATCHING,
+            'torch': torch.__version__,
+            'threads': torch.get_num_threads(),
+            'runs': opt.runs,
+        },
+        'results': results,
+    }
+    if opt.json:
+        Path(opt.json).write_text(json.dumps(report, indent=2))
+
+    if opt.baseline:
+        slower = regressions(results, opt.baseline, opt.tolerance)
+        for line in slower:
+            print(f"REGRESSION {line}")
+        return not slower
+    return True
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    sys.exit(0 if main(opt) else 1)
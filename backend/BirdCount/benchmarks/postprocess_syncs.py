@@ -0,0 +1,139 @@
+"""
+Host syncs and latency of density-map post-processing: the old per-cell /
+per-box / per-pixel loops against BirdCount.model_files.postprocess.
+
+A host sync is counted for every tensor -> Python transfer (.item(),
+.tolist(), .cpu(), .numpy()); on CUDA each one stalls until the queued
+kernels finish. The box map is drawn with one indexed write per pixel in the
+old code, so it is also reported as kernel launches.
+
+Usage (from backend/):
+    python -m BirdCount.benchmarks.postprocess_syncs --device cuda --runs 100
+"""
+
+import argparse
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+from BirdCount.model_files.postprocess import summarize, box_outline_mask
+
+TRANSFERS = ('item', 'tolist', 'cpu', 'numpy')
+
+# Rectangles ([y1, x1, y2, x2], model pixels) preprocess_image gives the default exemplars of a 4:3 image
+DEFAULT_RECTS = [[50, 65, 65, 83], [64, 100, 76, 356], [86, 288, 102, 363]]
+
+
+@contextmanager
+def count_syncs():
+    """Counts tensor -> host transfers made inside the block."""
+    counter = {'syncs': 0}
+    originals = {name: getattr(torch.Tensor, name) for name in TRANSFERS}
+
+    def wrap(fn):
+        def counted(self, *args, **kwargs):
+            counter['syncs'] += 1
+            return fn(self, *args, **kwargs)
+        return counted
+
+    for name, fn in originals.items():
+        setattr(torch.Tensor, name, wrap(fn))
+    try:
+        yield counter
+    finally:
+        for name, fn in originals.items():
+            setattr(torch.Tensor, name, fn)
+
+
+def legacy_postprocess(density_map, rects):
+    """The old subgrid loop, exemplar-box sums and count normalization, one .item() each."""
+    h, w = density_map.shape
+    subgrid_counts = []
+    for i in range(3):
+        for j in range(3):
+            subgrid = density_map[int(i * h / 3):int((i + 1) * h / 3), int(j * w / 3):int((j + 1) * w / 3)]
+            subgrid_counts.append(torch.sum(subgrid / 60).item())
+    pred_cnt = sum(subgrid_counts)
+    e_cnt = 0
+    for rect in rects:
+        e_cnt += torch.sum(density_map[rect[0]:rect[2] + 1, rect[1]:rect[3] + 1] / 60).item()
+    e_cnt = e_cnt / 3
+    if e_cnt > 1.8:
+        pred_cnt /= e_cnt
+    return pred_cnt, subgrid_counts
+
+
+def legacy_box_map(shape, rects, device):
+    box_map = torch.zeros(shape, device=device)
+    writes = 0
+    for rect in rects:
+        for i in range(rect[2] - rect[0]):
+            box_map[min(rect[0] + i, shape[0] - 1), min(rect[1], shape[1] - 1)] = 10
+            box_map[min(rect[0] + i, shape[0] - 1), min(rect[3], shape[1] - 1)] = 10
+            writes += 2
+        for i in range(rect[3] - rect[1]):
+            box_map[min(rect[0], shape[0] - 1), min(rect[1] + i, shape[1] - 1)] = 10
+            box_map[min(rect[2], shape[0] - 1), min(rect[1] + i, shape[1] - 1)] = 10
+            writes += 2
+    return box_map, writes
+
+
+def time_ms(fn, runs, device):
+    fn()
+    timings = []
+    for _ in range(runs):
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        fn()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        timings.append(time.perf_counter() - start)
+    return np.percentile(timings, 50) * 1000, np.percentile(timings, 95) * 1000
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--height', type=int, default=384)
+    parser.add_argument('--width', type=int, default=480)
+    return parser.parse_args()
+
+
+def main(opt):
+    device = torch.device(opt.device)
+    density = torch.rand((opt.height, opt.width), device=device) * 0.05
+    rects = DEFAULT_RECTS
+
+    # Same numbers either way
+    old_count, old_grid = legacy_postprocess(density, rects)
+    new = summarize(density, rects=rects)
+    assert np.allclose(old_grid, new['grid'], rtol=1e-4), (old_grid, new['grid'])
+    assert np.isclose(old_count, new['normalized_count'], rtol=1e-4), (old_count, new['normalized_count'])
+    old_map, writes = legacy_box_map(density.shape, rects, device)
+    assert torch.equal(old_map, box_outline_mask(density.shape, rects, device))
+
+    rows = []
+    for name, fn in (
+        ('grid + exemplar norm, loops', lambda: legacy_postprocess(density, rects)),
+        ('grid + exemplar norm, summarize', lambda: summarize(density, rects=rects)),
+        ('box map, per-pixel writes', lambda: legacy_box_map(density.shape, rects, device)),
+        ('box map, box_outline_mask', lambda: box_outline_mask(density.shape, rects, device)),
+    ):
+        with count_syncs() as counter:
+            fn()
+        p50, p95 = time_ms(fn, opt.runs, device)
+        rows.append((name, counter['syncs'], p50, p95))
+
+    print(f"{device} {opt.width}x{opt.height}, {len(rects)} exemplar boxes ({writes} per-pixel box writes in the old loop)")
+    print(f"{'path':<34}{'host syncs':>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, syncs, p50, p95 in rows:
+        print(f"{name:<34}{syncs:>12}{p50:>10.3f}{p95:>10.3f}")
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
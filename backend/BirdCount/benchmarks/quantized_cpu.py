@@ -0,0 +1,130 @@
+"""
+Accuracy, latency and memory of the dynamic INT8 CPU mode (BIRDCOUNT_QUANTIZE=1)
+against the fp32 model.
+
+Accuracy is the count MAE of INT8 vs fp32 over a fixture set: the images in
+--images if given, otherwise a fixed set of seeded synthetic images with
+dark blobs of known number on textured backgrounds.
+
+Each mode runs in its own subprocess so neither sees the other's memory.
+The INT8 engine loads fp32 weights and quantizes them in place, so its
+peak RSS still includes that load; compare 'rss_mb' (resident after
+loading and gc) and 'model_mb' (state_dict bytes) for the steady state.
+
+Usage (from backend/):
+    python -m BirdCount.benchmarks.quantized_cpu --runs 10 --threads 4
+    python -m BirdCount.benchmarks.quantized_cpu --images path/to/flock_photos --json report.json
+"""
+
+import argparse
+import gc
+import io
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from BirdCount.model_files.engine import CountingEngine
+from BirdCount.model_files.demomodified import predict_density_maps
+from BirdCount.benchmarks.device_latency import prepare, time_runs
+from BirdCount.benchmarks.fixtures import fixture_images, peak_rss_mb
+
+
+def load_images(folder):
+    paths = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+    return [Image.open(p).convert('RGB') for p in paths]
+
+
+def model_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1e6
+
+
+def current_rss_mb():
+    """Resident set size right now (Linux), unlike ru_maxrss which only ever grows."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1e6
+
+
+def evaluate(engine, inputs, runs):
+    counts = [predict_density_maps(engine.model, s, b).sum().item() / 60 for s, b in inputs]
+    p50, p95 = time_runs(lambda: predict_density_maps(engine.model, *inputs[0]), runs, engine.device)
+    return np.array(counts), p50, p95
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='folder of fixture photos (default: seeded synthetic set)')
+    parser.add_argument('--fixtures', type=int, default=8, help='synthetic fixture images when --images is not given')
+    parser.add_argument('--threads', type=int, default=0, help='CPU intra-op threads, 0 = one per physical core')
+    parser.add_argument('--runs', type=int, default=10, help='timed runs per mode')
+    parser.add_argument('--json', default=None, help='also write the report to this file')
+    parser.add_argument('--mode', choices=['int8', 'fp32'], default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_mode(opt):
+    """One mode in this process (the subprocess main() starts); writes its measurements to --result."""
+    device = torch.device('cpu')
+    images = load_images(opt.images) if opt.images else fixture_images(opt.fixtures)
+    inputs = [prepare(image, device) for image in images]
+    del images
+    gc.collect()
+    rss_before = current_rss_mb()
+    engine = CountingEngine(device=device, num_threads=opt.threads, backend='eager', quantize=opt.mode == 'int8')
+    gc.collect()
+    rss_loaded = current_rss_mb()
+    counts, p50, p95 = evaluate(engine, inputs, opt.runs)
+    Path(opt.result).write_text(json.dumps({
+        'counts': counts.tolist(),
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'model_mb': model_size_mb(engine.model),
+        'rss_mb': rss_loaded - rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def spawn_mode(opt, mode):
+    with tempfile.NamedTemporaryFile(suffix='.json') as result:
+        args = [sys.executable, '-m', 'BirdCount.benchmarks.quantized_cpu', '--mode', mode, '--result', result.name,
+                '--fixtures', str(opt.fixtures), '--threads', str(opt.threads), '--runs', str(opt.runs)]
+        if opt.images:
+            args += ['--images', opt.images]
+        subprocess.run(args, check=True)
+        return json.loads(Path(result.name).read_text())
+
+
+def main(opt):
+    if opt.mode:
+        return run_mode(opt)
+
+    report = {name: spawn_mode(opt, name) for name in ('fp32', 'int8')}
+    report['images'] = len(report['fp32']['counts'])
+    fp32, int8 = np.array(report['fp32']['counts']), np.array(report['int8']['counts'])
+    report['count_mae'] = float(np.abs(int8 - fp32).mean())
+    report['count_mape'] = float((np.abs(int8 - fp32) / np.maximum(fp32, 1)).mean())
+    report['speedup'] = report['fp32']['p50_ms'] / report['int8']['p50_ms']
+
+    print(f"{'mode':<8}{'p50 ms':>10}{'p95 ms':>10}{'model MB':>10}{'RSS MB':>10}{'peak RSS MB':>13}")
+    for name in ('fp32', 'int8'):
+        r = report[name]
+        print(f"{name:<8}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['model_mb']:>10.1f}{r['rss_mb']:>10.0f}{r['peak_rss_mb']:>13.0f}")
+    print(f"count MAE int8 vs fp32 over {report['images']} images: {report['count_mae']:.3f} "
+          f"({report['count_mape'] * 100:.2f}%), speedup {report['speedup']:.2f}x")
+
+    if opt.json:
+        Path(opt.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
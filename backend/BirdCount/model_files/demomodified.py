@@ -1,22 +1,23 @@
+import os
 import time
 import numpy as np
-from io import BytesIO
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torchvision import transforms
 import torchvision.transforms.functional as TF
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
 import timm
 from sklearn.cluster import DBSCAN
 import numpy as np
-from BirdCount.model_files.misc import make_grid
 from BirdCount.model_files import models_mae_cross
-import matplotlib.cm as cm
-device = torch.device('cuda')
+from BirdCount.model_files.engine import get_engine
+from BirdCount.model_files.render import render_overlay
+from BirdCount.model_files.peaks import find_peaks, encode_peaks
+from BirdCount.model_files.preprocess import preprocess_image, DEFAULT_EXEMPLARS, EXEMPLAR_BASE_WIDTH
+from BirdCount.model_files.inference_queue import inference_queue, BATCHING
+from BirdCount.model_files.stage_timer import stage
+from BirdCount.model_files.postprocess import grid_sums, summarize, DENSITY_SCALE
 import warnings  
-global model, model_without_ddp
 warnings.filterwarnings('ignore')
 
 """
@@ -33,314 +34,273 @@ class measure_time(object):
         self.duration = (time.perf_counter_ns() - self.start) / 1e9
 
 
-def plot_heatmap(density_map, count, buffer):
-    # Make sure that this function now writes to a BytesIO buffer instead of saving to a file path
-    fig, ax = plt.subplots()
-    im = ax.imshow(density_map.cpu().numpy(), cmap='viridis')
-    # ax.text(0, 0, f'Count: {count:.2f}', color='white', fontsize=12, va='top', ha='left', backgroundcolor='black')
-    # plt.colorbar(im)
-    fig.canvas.draw()  # This line draws the figure on the canvas so that it can be saved
-    plt.savefig(buffer, format='png')
-    plt.close()
-
-
-
-def load_image_nomongo(image):
-    W, H = image.size
-
-    # Resize the image size so that the height is 384
-    new_H = 384
-    new_W = 480
-    scale_factor_H = float(new_H) / H
-    scale_factor_W = float(new_W) / W
-    print(f"Original image size: {W}x{H}")
-    print(f"Processed image size: {new_W}x{new_H}")
-    print(f"Scaling factors: {scale_factor_W}, {scale_factor_H}")
-    image = transforms.Resize((new_H, new_W))(image)
-    Normalize = transforms.Compose([transforms.ToTensor()])
-    image = Normalize(image)
-
-    # Coordinates of the exemplar bound boxes
-    bboxes = [
-        [[136, 98], [173, 127]],
-        [[209, 125], [742, 150]],
-        [[602, 168], [758, 200]]
-]
-    boxes = list()
-    rects = list()
-    for bbox in bboxes:
-        x1 = int(bbox[0][0] * scale_factor_W)
-        y1 = int(bbox[0][1] * scale_factor_H)
-        x2 = int(bbox[1][0] * scale_factor_W)
-        y2 = int(bbox[1][1] * scale_factor_H)
-        rects.append([y1, x1, y2, x2])
-        bboxnew = image[:, y1:y2 + 1, x1:x2 + 1]
-        bboxnew = transforms.Resize((64, 64))(bboxnew)
-        boxes.append(bboxnew.numpy())
-
-    boxes = np.array(boxes)
-    boxes = torch.Tensor(boxes)
-
-    return image, boxes, rects
-
-
-
-def run_one_image_nomongo(samples, boxes, pos, model, orig_image_size):
-    _, _, h, w = samples.shape
-    orig_h, orig_w = orig_image_size
-
-    # Calculate the scaling factors
-    print("test : ",orig_h, orig_w, h, w)
-    scale_factor_H = orig_h / h
-    scale_factor_W = orig_w / w
-    s_cnt = 0
-    for rect in pos:
-        if rect[2] - rect[0] < 10 and rect[3] - rect[1] < 10:
-            s_cnt += 1
-    if s_cnt >= 1:
-        r_densities = []
-        r_images = []
-        r_images.append(TF.crop(samples[0], 0, 0, int(h / 3), int(w / 3)))  # 1
-        r_images.append(TF.crop(samples[0], 0, int(w / 3), int(h / 3), int(w / 3)))  # 3
-        r_images.append(TF.crop(samples[0], 0, int(w * 2 / 3), int(h / 3), int(w / 3)))  # 7
-        r_images.append(TF.crop(samples[0], int(h / 3), 0, int(h / 3), int(w / 3)))  # 2
-        r_images.append(TF.crop(samples[0], int(h / 3), int(w / 3), int(h / 3), int(w / 3)))  # 4
-        r_images.append(TF.crop(samples[0], int(h / 3), int(w * 2 / 3), int(h / 3), int(w / 3)))  # 8
-        r_images.append(TF.crop(samples[0], int(h * 2 / 3), 0, int(h / 3), int(w / 3)))  # 5
-        r_images.append(TF.crop(samples[0], int(h * 2 / 3), int(w / 3), int(h / 3), int(w / 3)))  # 6
-        r_images.append(TF.crop(samples[0], int(h * 2 / 3), int(w * 2 / 3), int(h / 3), int(w / 3)))  # 9
-
-        pred_cnt = 0
-        with measure_time() as et:
-            for r_image in r_images:
-                r_image = transforms.Resize((h, w))(r_image).unsqueeze(0)
-                density_map = torch.zeros([h, w])
-                density_map = density_map.to(device, non_blocking=True)
-                start = 0
-                prev = -1
-                with torch.no_grad():
-                    while start + 383 < w:
-                        output, = model(r_image[:, :, :, start:start + 384], boxes, 3)
-                        output = output.squeeze(0)
-                        b1 = nn.ZeroPad2d(padding=(start, w - prev - 1, 0, 0))
-                        d1 = b1(output[:, 0:prev - start + 1])
-                        b2 = nn.ZeroPad2d(padding=(prev + 1, w - start - 384, 0, 0))
-                        d2 = b2(output[:, prev - start + 1:384])
-
-                        b3 = nn.ZeroPad2d(padding=(0, w - start, 0, 0))
-                        density_map_l = b3(density_map[:, 0:start])
-                        density_map_m = b1(density_map[:, start:prev + 1])
-                        b4 = nn.ZeroPad2d(padding=(prev + 1, 0, 0, 0))
-                        density_map_r = b4(density_map[:, prev + 1:w])
-
-                        density_map = density_map_l + density_map_r + density_map_m / 2 + d1 / 2 + d2
-
-                        prev = start + 383
-                        start = start + 128
-                        if start + 383 >= w:
-                            if start == w - 384 + 128:
-                                break
-                            else:
-                                start = w - 384
-
-                pred_cnt += torch.sum(density_map / 60).item()
-                r_densities += [density_map]
-    else:
-        density_map = torch.zeros([h, w])
-        density_map = density_map.to(device, non_blocking=True)
-        start = 0
-        prev = -1
-        with measure_time() as et:
-            with torch.no_grad():
-                while start + 383 < w:
-                    output, = model(samples[:, :, :, start:start + 384], boxes, 3)
-                    output = output.squeeze(0)
-                    b1 = nn.ZeroPad2d(padding=(start, w - prev - 1, 0, 0))
-                    d1 = b1(output[:, 0:prev - start + 1])
-                    b2 = nn.ZeroPad2d(padding=(prev + 1, w - start - 384, 0, 0))
-                    d2 = b2(output[:, prev - start + 1:384])
-
-                    b3 = nn.ZeroPad2d(padding=(0, w - start, 0, 0))
-                    density_map_l = b3(density_map[:, 0:start])
-                    density_map_m = b1(density_map[:, start:prev + 1])
-                    b4 = nn.ZeroPad2d(padding=(prev + 1, 0, 0, 0))
-                    density_map_r = b4(density_map[:, prev + 1:w])
-
-                    density_map = density_map_l + density_map_r + density_map_m / 2 + d1 / 2 + d2
-
-                    prev = start + 383
-                    start = start + 128
-                    if start + 383 >= w:
-                        if start == w - 384 + 128:
-                            break
-                        else:
-                            start = w - 384
-
-            pred_cnt = torch.sum(density_map / 60).item()
-
-    # Normalize density_map for visualization
-    density_map = density_map.to('cuda')
-    samples = samples.to('cuda')
-
-    # Normalize density_map for visualization
-    density_normalized = density_map / density_map.max()
-
-    # Convert density map to RGBA image using a colormap
-    colormap = cm.get_cmap('jet')  # You can choose any available colormap
-    density_colormap = colormap(density_normalized.cpu().detach().numpy())  # Move to CPU and convert to numpy
-
-    # Convert RGBA image to RGB by ignoring the alpha channel
-    density_rgb = density_colormap[...,:3]
-
-    # Convert to tensor and move to GPU
-    density_rgb_tensor = torch.from_numpy(density_rgb).float().permute(2, 0, 1).to('cuda')
-
-    # Resize density_rgb_tensor to match the size of the original image
-    density_resized = TF.resize(density_rgb_tensor, samples.shape[2:])
-
-    # Blend the original image with the density map
-    # Adjust alpha to change the transparency of the overlay
-    alpha = 0.5
-    blended_image = (1 - alpha) * samples[0] + alpha * density_resized
-    
-    # Clamp the values to be between 0 and 1
-    blended_image_clamped = torch.clamp(blended_image, 0, 1)
-    
-    # Save or display the blended image
-    # Convert blended_image_clamped to PIL image to save or display
-    blended_image_pil = TF.to_pil_image(blended_image_clamped.cpu())
-    blended_image_buffer = BytesIO()
-    blended_image_pil.save(blended_image_buffer, format='PNG')
-    blended_image_buffer.seek(0)
-    #blended_image_file_id = fs.put(blended_image_buffer, filename='blended_heatmap.png', content_type='image/png')
-    e_cnt = 0
-    for rect in pos:
-        e_cnt += torch.sum(density_map[rect[0]:rect[2] + 1, rect[1]:rect[3] + 1] / 60).item()
-    e_cnt = e_cnt / 3
-    if e_cnt > 1.8:
-        pred_cnt /= e_cnt
-
-    # Visualize the prediction
-    fig = samples[0]
-    box_map = torch.zeros([fig.shape[1], fig.shape[2]])
-    box_map = box_map.to(device, non_blocking=True)
-    for rect in pos:
-        for i in range(rect[2] - rect[0]):
-            box_map[min(rect[0] + i, fig.shape[1] - 1), min(rect[1], fig.shape[2] - 1)] = 10
-            box_map[min(rect[0] + i, fig.shape[1] - 1), min(rect[3], fig.shape[2] - 1)] = 10
-        for i in range(rect[3] - rect[1]):
-            box_map[min(rect[0], fig.shape[1] - 1), min(rect[1] + i, fig.shape[2] - 1)] = 10
-            box_map[min(rect[2], fig.shape[1] - 1), min(rect[1] + i, fig.shape[2] - 1)] = 10
-    box_map = box_map.unsqueeze(0).repeat(3, 1, 1)
-    pred = density_map.unsqueeze(0).repeat(3, 1, 1) if s_cnt < 1 \
-        else make_grid(r_densities, h, w).unsqueeze(0).repeat(3, 1, 1)
-    fig = fig + box_map + pred / 2
-    fig = torch.clamp(fig, 0, 1)
-    heatmap_buffer = BytesIO()
-    plot_heatmap(density_map, pred_cnt, heatmap_buffer)
-    heatmap_buffer.seek(0)
-    #heatmap_file_id = fs.put(heatmap_buffer, filename='heatmap.png', content_type='image/png')
-    pred_cnt_ceil = int(pred_cnt + 0.99)
-    # Thresholding the density map
-   
-    # Convert cluster centers to a format suitable for JSON serialization
-    # This will be useful for sending data to the frontend
-    
-     # Include cluster_centers_json in the return statement
-    return pred_cnt_ceil, et.duration, blended_image_clamped, density_map, pred_cnt
-  
-
+WINDOW_SIZE = 384
+WINDOW_STRIDE = 128
+# Upper bound on windows per forward pass; keeps activation memory bounded
+MAX_WINDOW_BATCH = int(os.getenv('BIRDCOUNT_MAX_WINDOW_BATCH', '16'))
 
 
+def window_offsets(w, window=WINDOW_SIZE, stride=WINDOW_STRIDE):
+    """Left edges of the sliding windows; the last window is snapped to the right border."""
+    if w < window:
+        return []
+    offsets = list(range(0, w - window + 1, stride))
+    if offsets[-1] != w - window:
+        offsets.append(w - window)
+    return offsets
 
-import numpy as np
-import scipy.ndimage as ndimage
 
-def detect_local_maxima(density_map, threshold, min_distance=3):
+def predict_density_maps(model, images, boxes, shot_num=3, max_batch=MAX_WINDOW_BATCH, image_keys=None):
     """
-    Detects local maxima in the density map to identify individual bird locations.
-    
+    Runs every sliding window of every image through the model in batches and
+    stitches the outputs into one accumulation buffer, averaging overlaps.
+
     Args:
-        density_map (torch.Tensor or np.ndarray): The density map of bird locations.
-        threshold (float): The minimum density value to consider a point as a bird.
-        min_distance (int): The minimum distance between two detected peaks.
-    
+        images (torch.Tensor): [N, 3, h, w] images at model resolution.
+        boxes (torch.Tensor): [N, 3, 3, 64, 64] exemplar crops for each image.
+        image_keys (list): optional stable key per image (e.g. content hash);
+            keyed windows reuse cached encoder latents, see encoder_latents().
+
     Returns:
-        List[dict]: A list of dictionaries containing 'x' and 'y' coordinates of detected birds.
+        torch.Tensor: [N, h, w] density maps.
+    """
+    n, _, h, w = images.shape
+    offsets = window_offsets(w)
+    density = torch.zeros([n, h, w], device=images.device)
+    coverage = torch.zeros([w], device=images.device)
+    for start in offsets:
+        coverage[start:start + WINDOW_SIZE] += 1
+
+    jobs = [(start, i) for start in offsets for i in range(n)]
+    with torch.no_grad():
+        # Exemplar projections depend only on the image, not on the window
+        with stage('exemplar_embeddings'):
+            embeddings = model.exemplar_embeddings(boxes, shot_num)
+        for c in range(0, len(jobs), max_batch):
+            chunk = jobs[c:c + max_batch]
+            windows = torch.stack([images[i, :, :, start:start + WINDOW_SIZE] for start, i in chunk])
+            keys = None
+            if image_keys is not None:
+                keys = [(image_keys[i], start) if image_keys[i] is not None else None for start, i in chunk]
+            with stage('encoder'):
+                latents = model.encoder_latents(windows, keys)
+            window_embeddings = embeddings[[i for _, i in chunk]]
+            with stage('decoder'):
+                output = model.forward_decoder(latents, None, shot_num, exemplar_embeddings=window_embeddings)
+            for (start, i), window_density in zip(chunk, output):
+                density[i, :, start:start + WINDOW_SIZE] += window_density
+
+    return density / coverage.clamp(min=1)
+
+
+# Exemplar boxes smaller than this (model pixels, both sides) send an image down the 3x3 crop path
+TINY_EXEMPLAR_PX = 10
+
+
+def crop_cells(h, w, rows=3, cols=3):
+    """(top, left, height, width) of the tiny-exemplar crops, row-major."""
+    ch, cw = int(h / rows), int(w / cols)
+    return [(int(h * r / rows), int(w * c / cols), ch, cw) for r in range(rows) for c in range(cols)]
+
+
+def density_inputs(samples, pos):
     """
-    # Convert tensor to numpy array if needed
-    if hasattr(density_map, 'cpu'):
-        density_map = density_map.cpu().numpy()
+    Returns the images the model has to see for one sample: the sample itself, or
+    its 3×3 crops upscaled to full size when the exemplar boxes are tiny (see
+    merge_crop_densities for putting their maps back together).
+    """
+    _, _, h, w = samples.shape
+    s_cnt = 0
+    for rect in pos:
+        if rect[2] - rect[0] < TINY_EXEMPLAR_PX and rect[3] - rect[1] < TINY_EXEMPLAR_PX:
+            s_cnt += 1
+    if s_cnt < 1:
+        return samples
 
-    # Apply threshold
-    mask = density_map > threshold
+    resize = transforms.Resize((h, w))
+    return torch.stack([resize(TF.crop(samples[0], top, left, ch, cw)) for top, left, ch, cw in crop_cells(h, w)])
 
-    # Find local maxima using a maximum filter
-    local_max = (density_map == ndimage.maximum_filter(density_map, size=min_distance)) & mask
-    y, x = np.where(local_max)  # Extract coordinates
 
-    return [{'x': int(x[i]), 'y': int(y[i])} for i in range(len(x))]
+def merge_crop_densities(densities, h, w):
+    """
+    One full-frame [h, w] map from the maps of the upscaled 3×3 crops: each is
+    area-downsampled into its cell and rescaled so its mass (the crop's count)
+    is kept. Pixels outside the cells (when h or w isn't divisible by 3) stay 0.
+    """
+    merged = densities.new_zeros((h, w))
+    scale = densities.shape[1] * densities.shape[2]
+    for density, (top, left, ch, cw) in zip(densities, crop_cells(h, w)):
+        cell = F.interpolate(density[None, None], size=(ch, cw), mode='area')[0, 0]
+        merged[top:top + ch, left:left + cw] = cell * (scale / (ch * cw))
+    return merged
 
-# Example usage:
-# detected_birds = detect_local_maxima(density_map, threshold=0.5, min_distance=3)
-# print(detected_birds)
 
+def subgrid_counts_nomongo(density_map, rows=3, cols=3):
+    """Counts in each cell of a rows x cols grid, row-major, with one host sync."""
+    return (grid_sums(density_map, rows, cols).flatten() / DENSITY_SCALE).tolist()
 
-# Prepare model
-model = models_mae_cross.__dict__['mae_vit_base_patch16'](norm_pix_loss='store_true')
-model.to(device)
-model_without_ddp = model
 
-from pathlib import Path
+def subgrid_counts_with_error(subgrid_counts):
+    # subgridcnts are floats, put into format of [(int, float), (int, float), ...] where int is rounded (not floored) and flt is decimal part
+    subgrid_counts_with_error = []
+    for subgrid_count in subgrid_counts:
+        subgrid_count_int = int(subgrid_count)
+        subgrid_count_flt = subgrid_count - subgrid_count_int
+        subgrid_counts_with_error.append((subgrid_count_int, subgrid_count_flt))
+    return subgrid_counts_with_error
 
-checkpoint_path = Path(__file__).resolve().parent / 'pth/original.pth'
-checkpoint = torch.load(checkpoint_path, map_location='cuda')
-model_without_ddp.load_state_dict(checkpoint['model'], strict=False)
-# print("Resume checkpoint %s" % './checkpoint-400.pth')
 
-model.eval()
+def detect_local_maxima(density_map, threshold, min_distance=3):
+    """
+    Detects local maxima in the density map to identify individual bird locations.
 
-def run_demo_image_nomongo(image):
-    basewidth = 1000
-    wpercent = (basewidth / float(image.size[0]))
-    hsize = int((float(image.size[1]) * float(wpercent)))
-    image = image.resize((basewidth, hsize))
-    samples, boxes, pos = load_image_nomongo(image)
-    samples = samples.unsqueeze(0).to(device, non_blocking=True)
-    boxes = boxes.unsqueeze(0).to(device, non_blocking=True)
-    orig_image_size = samples.shape[2:]  # Capture the original image size
-    # Now, run_one_image returns the density_map as well
-    pred_cnt_int, elapsed_time, heatmap_file, density_map, pred_cnt_flt = run_one_image_nomongo(samples, boxes, pos, model, orig_image_size)
+    Returns:
+        List[dict]: A list of dictionaries containing 'x' and 'y' coordinates of detected birds.
+        Prefer peaks.find_peaks, which returns a compact [N, 2] array.
+    """
+    return encode_peaks(find_peaks(density_map, threshold, min_distance))
 
-    # Compute scale factors based on the original image size and the processed size
-    scale_factors = {'W': orig_image_size[1]/density_map.shape[1], 'H': orig_image_size[0]/density_map.shape[0]}
-    print(scale_factors)
 
-    # Generate multiple sets of cluster centers
+def prepare_image_nomongo(image, exemplars=None):
+    """Preprocesses an image (PIL image, bytes or path) and moves it to the engine's device."""
+    samples, boxes, pos = preprocess_image(image, exemplars)
+    device = get_engine().device
+    with stage('to_device'):
+        samples = samples.unsqueeze(0).to(device, non_blocking=True)
+        boxes = boxes.unsqueeze(0).to(device, non_blocking=True)
+    return samples, boxes, pos
 
-    cluster_centers_sets = detect_local_maxima(density_map, threshold=0.25, min_distance=3)
 
-    density_map_height = density_map.shape[0]
-    density_map_width = density_map.shape[1]
-    subgrid_counts = []
-    #create a 3x3 grid in density_map, then sum up each grid and append to subgrid_counts, use size of map instead of hardcoding
-    for i in range(3):
-        for j in range(3):
-            
-            subgrid = density_map[int(i * density_map_height / 3):int((i + 1) * density_map_height / 3), int(j * density_map_width / 3):int((j + 1) * density_map_width / 3)]
-            subgrid_count = torch.sum(subgrid / 60).item()
-            subgrid_counts.append(subgrid_count)
+# Artifacts the counting pipeline can produce; callers request only what they use
+OUTPUT_COUNT = 'count'
+OUTPUT_GRID = 'grid'
+OUTPUT_PEAKS = 'peaks'  # [N, 2] int32 (x, y) array; serialize with peaks.encode_peaks
+OUTPUT_OVERLAY = 'overlay'
+OUTPUT_DENSITY = 'density'
+ALL_OUTPUTS = frozenset({OUTPUT_COUNT, OUTPUT_GRID, OUTPUT_PEAKS, OUTPUT_OVERLAY, OUTPUT_DENSITY})
 
-    # subgridcnts are floats, put into format of [(int, float), (int, float), ...] where int is rounded (not floored) and flt is decimal part
-    subgrid_counts_with_error = []
-    for subgrid_count in subgrid_counts:
-        subgrid_count_int = int(subgrid_count)
-        subgrid_count_flt = subgrid_count - subgrid_count_int
-        subgrid_counts_with_error.append((subgrid_count_int, subgrid_count_flt))
-    pred_cnt_flt =  sum(subgrid_counts)
-    pred_cnt_int = int(pred_cnt_flt + 0.99)
-    
+# Default peak extraction parameters (density units, pixels at model resolution)
+PEAK_THRESHOLD = 0.25
+PEAK_MIN_DISTANCE = 3
 
 
-    return pred_cnt_int, elapsed_time, heatmap_file, cluster_centers_sets, orig_image_size, subgrid_counts, pred_cnt_flt, subgrid_counts_with_error
+def postprocess_nomongo(density_map, outputs, image_size, samples=None,
+                        peak_threshold=PEAK_THRESHOLD, peak_min_distance=PEAK_MIN_DISTANCE, rects=None):
+    """
+    Derives the requested outputs from a density map. Only the overlay needs the
+    image (`samples`); counts, grid counts and peaks are pure tensor math, which
+    is what lets stored density maps be re-thresholded without the model.
+    With the exemplar `rects` the count also comes with 'exemplar_count' and
+    the exemplar-'normalized_count' (see postprocess.summarize).
+    """
+    result = {'image_size': tuple(image_size)}
+    if OUTPUT_DENSITY in outputs:
+        result[OUTPUT_DENSITY] = density_map
+    if OUTPUT_PEAKS in outputs:
+        with stage('peaks'):
+            result[OUTPUT_PEAKS] = find_peaks(density_map, peak_threshold, peak_min_distance)
+    if OUTPUT_OVERLAY in outputs:
+        with stage('overlay'):
+            result[OUTPUT_OVERLAY] = render_overlay(samples, density_map)
+    if OUTPUT_GRID in outputs or OUTPUT_COUNT in outputs:
+        with stage('grid'):
+            summary = summarize(density_map, rects=rects if OUTPUT_COUNT in outputs else None)
+        if OUTPUT_GRID in outputs:
+            result[OUTPUT_GRID] = summary['grid']
+        if OUTPUT_COUNT in outputs:
+            result[OUTPUT_COUNT] = summary['count']
+            if rects:
+                result['exemplar_count'] = summary['exemplar_count']
+                result['normalized_count'] = summary['normalized_count']
+    return result
+
+
+def scale_exemplars(boxes, image_width):
+    """
+    Converts exemplar boxes given as (x1, y1, x2, y2) in original image pixels to
+    the [[x1, y1], [x2, y2]] form preprocess_image expects. Fewer than three
+    boxes are padded by repetition; the model only reads the first `shot_num`.
+    """
+    scale = EXEMPLAR_BASE_WIDTH / float(image_width)
+    bboxes = [[[x1 * scale, y1 * scale], [x2 * scale, y2 * scale]] for x1, y1, x2, y2 in boxes]
+    if not bboxes:
+        return DEFAULT_EXEMPLARS
+    return (bboxes * 3)[:3]
+
 
+def count_images_nomongo(images, outputs=ALL_OUTPUTS, max_batch=MAX_WINDOW_BATCH,
+                         image_keys=None, exemplars=None, shot_num=3):
+    """
+    Runs the counter on `images` in one batch (every window of every image, in
+    chunks of at most `max_batch` windows) and returns one dict per image with
+    the requested `outputs` plus 'elapsed_time' and 'image_size'.
+
+    `image_keys` enables the encoder-latent cache (one stable key per image).
+    `images` may be PIL images, encoded bytes or paths; each is decoded once.
+    `exemplars` overrides the default exemplar boxes for every image, in the
+    1000-px-wide coordinates of DEFAULT_EXEMPLARS (see scale_exemplars).
+    """
+    outputs = frozenset(outputs)
+    prepared = [prepare_image_nomongo(image, exemplars) for image in images]
+    inputs = [density_inputs(samples, pos) for samples, _, pos in prepared]
+    all_images = torch.cat(inputs)
+    all_boxes = torch.cat([boxes.expand(len(r_images), -1, -1, -1, -1) for (_, boxes, _), r_images in zip(prepared, inputs)])
+    all_keys = None
+    if image_keys is not None:
+        # Upscaled crops of the tiny-exemplar path are different windows, so key them apart
+        all_keys = [key if len(r_images) == 1 else f"{key}:crop{j}"
+                    for key, r_images in zip(image_keys, inputs) for j in range(len(r_images))]
+    with measure_time() as et, stage('inference'):
+        if BATCHING:
+            # Shares forward passes with concurrent requests; see inference_queue
+            densities = inference_queue.predict(all_images, all_boxes, shot_num=shot_num, image_keys=all_keys)
+        else:
+            densities = predict_density_maps(get_engine().model, all_images, all_boxes, shot_num=shot_num,
+                                             max_batch=max_batch, image_keys=all_keys)
+
+    results = []
+    offset = 0
+    for (samples, _, pos), r_images in zip(prepared, inputs):
+        if len(r_images) == 1:
+            density_map = densities[offset]
+        else:
+            # Tiny exemplars: stitch the nine crops' maps back into one map of the whole image
+            density_map = merge_crop_densities(densities[offset:offset + len(r_images)], *samples.shape[2:])
+        offset += len(r_images)
+        result = postprocess_nomongo(density_map, outputs, samples.shape[2:], samples, rects=pos)
+        result['elapsed_time'] = et.duration / len(prepared)
+        results.append(result)
+    return results
+
+
+def complete_result_nomongo(result, image, outputs):
+    """Adds missing outputs to an earlier result from its stored density map, without rerunning the model."""
+    samples = prepare_image_nomongo(image)[0] if OUTPUT_OVERLAY in outputs else None
+    extra = postprocess_nomongo(result[OUTPUT_DENSITY], outputs, result['image_size'], samples)
+    return {**result, **extra}
+
+
+def as_legacy_tuple(result):
+    """The 8-tuple historically returned by run_demo_image_nomongo; skipped outputs are None."""
+    subgrid_counts = result.get(OUTPUT_GRID)
+    pred_cnt_flt = result.get(OUTPUT_COUNT)
+    pred_cnt_int = int(pred_cnt_flt + 0.99) if pred_cnt_flt is not None else None
+    return (
+        pred_cnt_int,
+        result['elapsed_time'],
+        result.get(OUTPUT_OVERLAY),
+        encode_peaks(result[OUTPUT_PEAKS]) if OUTPUT_PEAKS in result else None,
+        result['image_size'],
+        subgrid_counts,
+        pred_cnt_flt,
+        subgrid_counts_with_error(subgrid_counts) if subgrid_counts is not None else None,
+    )
+
+
+def run_demo_images_nomongo(images, outputs=ALL_OUTPUTS, max_batch=MAX_WINDOW_BATCH):
+    """Batched variant of run_demo_image_nomongo; results are returned in input order."""
+    return [as_legacy_tuple(result) for result in count_images_nomongo(images, outputs, max_batch)]
+
+
+def run_demo_image_nomongo(image, outputs=ALL_OUTPUTS):
+    return run_demo_images_nomongo([image], outputs)[0]
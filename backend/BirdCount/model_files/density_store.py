@@ -0,0 +1,75 @@
+import io
+
+import numpy as np
+import torch
+
+from Common.shared_utils import logger, get_db_connection
+
+# Raw density maps of uploaded images live in density_maps (compressed float16 .npz
+# bytes), one row per image. The row goes with the image (ON DELETE CASCADE), and a
+# recreated database can't hand an old map to a new image that reuses its id.
+
+
+def encode_density(density_map) -> bytes:
+    if isinstance(density_map, torch.Tensor):
+        density_map = density_map.detach().cpu().numpy()
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, density=density_map.astype(np.float16))
+    return buffer.getvalue()
+
+
+def decode_density(data):
+    with np.load(io.BytesIO(bytes(data))) as npz:
+        return npz['density'].astype(np.float32)
+
+
+def save_density(cur, image_id: int, density_map) -> bool:
+    """
+    Stores the model-resolution density map of an image as float16 so peaks and
+    counts can be recomputed later without the model, in the caller's
+    transaction. Returns False on failure; callers treat a missing map as
+    "not available" rather than an error.
+    """
+    try:
+        data = encode_density(density_map)
+    except Exception as e:
+        logger.error(f"Could not encode density map for image {image_id}: {e}")
+        return False
+    cur.execute(
+        """
+        INSERT INTO density_maps (image_id, density) VALUES (%s, %s)
+        ON CONFLICT (image_id) DO UPDATE SET density = EXCLUDED.density
+        """,
+        (image_id, data)
+    )
+    return True
+
+
+def density_rows(image_ids, density_maps):
+    """(image_id, density) rows for a batched execute_values insert; maps that fail to encode are left out."""
+    rows = []
+    for image_id, density_map in zip(image_ids, density_maps):
+        try:
+            rows.append((image_id, encode_density(density_map)))
+        except Exception as e:
+            logger.error(f"Could not encode density map for image {image_id}: {e}")
+    return rows
+
+
+def load_density(image_id: int):
+    """Returns the stored [h,w] float32 density map of an image, or None if there isn't one."""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT density FROM density_maps WHERE image_id = %s", (image_id,))
+                row = cur.fetchone()
+    except Exception as e:
+        logger.warning(f"Could not read density map for image {image_id}: {e}")
+        return None
+    if row is None:
+        return None
+    try:
+        return decode_density(row[0])
+    except Exception as e:
+        logger.warning(f"Unreadable density map for image {image_id}: {e}")
+        return None
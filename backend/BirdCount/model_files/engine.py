@@ -0,0 +1,161 @@
+import os
+import threading
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+from Common.shared_utils import logger
+from BirdCount.model_files import models_mae_cross
+from BirdCount.model_files.exported_model import ExportedMAE, EXPORT_DIR
+
+CHECKPOINT_PATH = Path(__file__).resolve().parent / 'pth/original.pth'
+
+# 'cuda', 'cuda:1', 'cpu', ...; CUDA is used when available if unset
+DEVICE = os.getenv('BIRDCOUNT_DEVICE')
+# Intra-op threads for CPU inference; 0 uses one thread per physical core
+NUM_THREADS = int(os.getenv('BIRDCOUNT_NUM_THREADS', '0'))
+# Encoder outputs kept for recounts with new exemplars (~1.8 MB each, on the model's device)
+LATENT_CACHE_WINDOWS = int(os.getenv('BIRDCOUNT_LATENT_CACHE_WINDOWS', '64'))
+# 'eager' runs the PyTorch modules; 'onnx' or 'torchscript' the graphs written by
+# `python -m BirdCount.model_files.export` to BIRDCOUNT_EXPORT_DIR
+BACKEND = os.getenv('BIRDCOUNT_BACKEND', 'eager').lower()
+EXPORT_DIR_PATH = Path(os.getenv('BIRDCOUNT_EXPORT_DIR', str(EXPORT_DIR)))
+# Set BIRDCOUNT_QUANTIZE=1 to run the eager model's nn.Linear layers with dynamic INT8 weights on CPU
+QUANTIZE = os.getenv('BIRDCOUNT_QUANTIZE', '0') != '0'
+# 'background' loads and warms the model on a thread at startup, 'lazy' on first use
+WARMUP = os.getenv('BIRDCOUNT_WARMUP', 'background').lower()
+
+# Production input: one 480x384 image gives two 384x384 windows with three 64x64 exemplars
+WARMUP_WINDOWS = 2
+WINDOW_SHAPE = (3, 384, 384)
+EXEMPLAR_SHAPE = (3, 3, 64, 64)
+
+
+def select_device(preferred=DEVICE):
+    """Picks the inference device, falling back to CPU when CUDA is requested but missing."""
+    if preferred:
+        device = torch.device(preferred)
+        if device.type == 'cuda' and not torch.cuda.is_available():
+            logger.warning(f"BirdCount device {preferred} requested but CUDA is not available, using CPU")
+            return torch.device('cpu')
+        return device
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def configure_cpu_threads(num_threads=NUM_THREADS):
+    """Sets torch intra-op parallelism for CPU inference and returns the thread count used."""
+    if num_threads <= 0:
+        try:
+            import psutil
+            num_threads = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+        except ImportError:
+            num_threads = os.cpu_count() or 1
+    torch.set_num_threads(num_threads)
+    return num_threads
+
+
+def quantize_dynamic_int8(model):
+    """
+    Dynamic INT8 quantization of every nn.Linear (the ViT encoder blocks and the
+    cross-attention decoder, nearly all of the compute); weights are stored as
+    int8 and activations quantized per batch. Convs and norms stay fp32. CPU only.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_counting_model(device, checkpoint_path=CHECKPOINT_PATH, quantize=False):
+    model = models_mae_cross.__dict__['mae_vit_base_patch16'](norm_pix_loss='store_true', latent_cache_size=LATENT_CACHE_WINDOWS)
+    checkpoint = torch.load(checkpoint_path, map_location=device)
+    model.load_state_dict(checkpoint['model'], strict=False)
+    model.to(device)
+    model.eval()
+    if quantize:
+        if device.type != 'cpu':
+            logger.warning(f"BirdCount INT8 quantization is CPU only, running fp32 on {device}")
+        else:
+            model = quantize_dynamic_int8(model)
+    return model
+
+
+def load_backend(device, backend=BACKEND, checkpoint_path=CHECKPOINT_PATH, export_dir=EXPORT_DIR_PATH, quantize=QUANTIZE):
+    """
+    Returns (model, backend actually used). Exported backends fall back to
+    eager PyTorch when their graphs or runtime are missing.
+    """
+    if backend != 'eager':
+        try:
+            return ExportedMAE(export_dir, backend, device, latent_cache_size=LATENT_CACHE_WINDOWS), backend
+        except (ImportError, FileNotFoundError, ValueError, RuntimeError) as e:
+            logger.warning(f"BirdCount {backend} backend unavailable ({e}), using eager PyTorch")
+    return load_counting_model(device, checkpoint_path, quantize), 'eager'
+
+
+class CountingEngine:
+    """SupervisedMAE bird counter bound to a single device chosen at startup."""
+
+    def __init__(self, device=None, num_threads=None, checkpoint_path=CHECKPOINT_PATH, backend=None, quantize=None):
+        self.device = device if isinstance(device, torch.device) else select_device(device or DEVICE)
+        self.num_threads = None
+        if self.device.type == 'cpu':
+            self.num_threads = configure_cpu_threads(NUM_THREADS if num_threads is None else num_threads)
+        logger.info(f"Loading BirdCount model ({backend or BACKEND}) on {self.device}"
+                    + (f" with {self.num_threads} threads" if self.num_threads else ""))
+        quantize = QUANTIZE if quantize is None else quantize
+        self.model, self.backend = load_backend(self.device, backend or BACKEND, checkpoint_path, quantize=quantize)
+        self.quantized = quantize and self.backend == 'eager' and self.device.type == 'cpu'
+        self.ready = False
+
+    def warm_up(self):
+        """Runs a dummy batch at production resolution so the first request doesn't pay for lazy init."""
+        windows = torch.zeros((WARMUP_WINDOWS, *WINDOW_SHAPE), device=self.device)
+        boxes = torch.zeros((WARMUP_WINDOWS, *EXEMPLAR_SHAPE), device=self.device)
+        with torch.no_grad():
+            self.model(windows, boxes, 3)
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        self.ready = True
+        logger.info("BirdCount model warmed up")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Returns the process-wide counting engine, loading and warming it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = CountingEngine()
+                engine.warm_up()
+                _engine = engine
+    return _engine
+
+
+def is_ready():
+    return _engine is not None and _engine.ready
+
+
+def status():
+    return {
+        "ready": is_ready(),
+        "device": str(_engine.device) if _engine is not None else None,
+        "backend": _engine.backend if _engine is not None else BACKEND,
+        "quantized": _engine.quantized if _engine is not None else QUANTIZE,
+        "warmup": WARMUP,
+    }
+
+
+def start_background_warm_up():
+    """Loads the engine on a daemon thread so API workers start without waiting for the checkpoint."""
+    def _load():
+        try:
+            get_engine()
+        except Exception as e:
+            logger.error(f"BirdCount warm-up failed: {e}")
+
+    thread = threading.Thread(target=_load, name="birdcount-warmup", daemon=True)
+    thread.start()
+    return thread
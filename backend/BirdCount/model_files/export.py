@@ -0,0 +1,159 @@
+"""
+Export the BirdCount SupervisedMAE counter (mae_vit_base_patch16) for the
+counting engine's ONNX Runtime / TorchScript backends.
+
+Writes encoder, exemplar and decoder graphs for 384x384 windows with three
+64x64 exemplars (batch stays dynamic), then checks that density maps from
+each exported backend match eager PyTorch on a synthetic image.
+
+Usage (from backend/):
+    python -m BirdCount.model_files.export --include onnx torchscript
+    BIRDCOUNT_BACKEND=onnx uvicorn main:app ...
+
+Requirements:
+    pip install onnx onnxruntime  # onnxruntime-gpu for CUDA
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+from Common.shared_utils import logger
+from BirdCount.model_files.engine import load_counting_model, CHECKPOINT_PATH, WINDOW_SHAPE, EXEMPLAR_SHAPE
+from BirdCount.model_files.exported_model import ExportedMAE, EXPORT_DIR, SHOT_TOKEN_FILE, graph_path
+from BirdCount.model_files.demomodified import predict_density_maps
+from BirdCount.model_files.preprocess import preprocess_image
+from BirdCount.benchmarks.fixtures import synthetic_image
+
+# Density tolerance for the parity check; counts are density.sum() / 60
+PARITY_ATOL = 1e-3
+
+
+class _Encoder(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, windows):
+        return self.model.forward_encoder(windows)
+
+
+class _Exemplars(nn.Module):
+    """One exemplar crop -> one token; shots are arranged by ExportedMAE.forward_exemplars."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, crops):
+        y = self.model.decoder_proj1(crops)
+        y = self.model.decoder_proj2(y)
+        y = self.model.decoder_proj3(y)
+        y = self.model.decoder_proj4(y)
+        return y.flatten(1)
+
+
+class _Decoder(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, latents, exemplars):
+        return self.model.forward_decoder(latents, None, exemplars.shape[1], exemplar_embeddings=exemplars)
+
+
+def example_inputs(model, device, batch=2):
+    windows = torch.rand((batch, *WINDOW_SHAPE), device=device)
+    crops = torch.rand((batch * EXEMPLAR_SHAPE[0], *EXEMPLAR_SHAPE[1:]), device=device)
+    with torch.no_grad():
+        latents = model.forward_encoder(windows)
+        tokens = _Exemplars(model)(crops).reshape(batch, EXEMPLAR_SHAPE[0], -1)
+    return {'encoder': (windows,), 'exemplars': (crops,), 'decoder': (latents, tokens)}
+
+
+GRAPH_SPECS = {
+    # name: (wrapper, input names, output name, dynamic axes)
+    'encoder': (_Encoder, ['windows'], 'latents', {'windows': {0: 'batch'}, 'latents': {0: 'batch'}}),
+    'exemplars': (_Exemplars, ['crops'], 'tokens', {'crops': {0: 'crops'}, 'tokens': {0: 'crops'}}),
+    'decoder': (_Decoder, ['latents', 'exemplars'], 'density',
+                {'latents': {0: 'batch'}, 'exemplars': {0: 'batch', 1: 'shots'}, 'density': {0: 'batch'}}),
+}
+
+
+def export_onnx(model, inputs, out_dir, opset):
+    for name, (wrapper, input_names, output_name, dynamic_axes) in GRAPH_SPECS.items():
+        f = graph_path(out_dir, name, 'onnx')
+        torch.onnx.export(wrapper(model).eval(), inputs[name], str(f), opset_version=opset,
+                          do_constant_folding=True, input_names=input_names, output_names=[output_name],
+                          dynamic_axes=dynamic_axes)
+        try:
+            import onnx
+            onnx.checker.check_model(onnx.load(str(f)))
+        except ImportError:
+            pass
+        logger.info(f"ONNX: saved {f} ({f.stat().st_size / 1e6:.1f} MB)")
+
+
+def export_torchscript(model, inputs, out_dir):
+    for name, (wrapper, _, _, _) in GRAPH_SPECS.items():
+        f = graph_path(out_dir, name, 'torchscript')
+        with torch.no_grad():
+            traced = torch.jit.trace(wrapper(model).eval(), inputs[name], check_trace=False)
+        traced.save(str(f))
+        logger.info(f"TorchScript: saved {f} ({f.stat().st_size / 1e6:.1f} MB)")
+
+
+def check_parity(model, exported, device, image=None):
+    """Density maps of eager and exported backends on the same image: (max abs difference, count difference)."""
+    samples, boxes, _ = preprocess_image(image or synthetic_image())
+    samples, boxes = samples.unsqueeze(0).to(device), boxes.unsqueeze(0).to(device)
+    eager = predict_density_maps(model, samples, boxes)
+    other = predict_density_maps(exported, samples, boxes)
+    return (eager - other).abs().max().item(), abs(eager.sum().item() - other.sum().item()) / 60
+
+
+def run(include=('onnx', 'torchscript'), out_dir=EXPORT_DIR, checkpoint=CHECKPOINT_PATH, device='cpu', opset=17,
+        atol=PARITY_ATOL):
+    device = torch.device(device)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model = load_counting_model(device, checkpoint)
+    torch.save(model.shot_token.detach().cpu(), out_dir / SHOT_TOKEN_FILE)
+
+    inputs = example_inputs(model, device)
+    if 'onnx' in include:
+        export_onnx(model, inputs, out_dir, opset)
+    if 'torchscript' in include:
+        export_torchscript(model, inputs, out_dir)
+
+    ok = True
+    for backend in include:
+        max_diff, count_diff = check_parity(model, ExportedMAE(out_dir, backend, device), device)
+        passed = max_diff <= atol
+        ok &= passed
+        logger.info(f"{backend} parity vs eager: max density diff {max_diff:.2e}, count diff {count_diff:.4f} "
+                    f"({'ok' if passed else f'FAILED, tolerance {atol:.0e}'})")
+    return ok
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--include', nargs='+', default=['onnx', 'torchscript'], choices=['onnx', 'torchscript'])
+    parser.add_argument('--out-dir', default=str(EXPORT_DIR), help='where the engine looks by default (BIRDCOUNT_EXPORT_DIR)')
+    parser.add_argument('--checkpoint', default=str(CHECKPOINT_PATH))
+    parser.add_argument('--device', default='cpu', help='cpu or cuda; ONNX graphs are portable either way')
+    parser.add_argument('--opset', type=int, default=17, help='ONNX opset version')
+    parser.add_argument('--atol', type=float, default=PARITY_ATOL, help='max density difference allowed by the parity check')
+    return parser.parse_args()
+
+
+def main(opt):
+    return run(opt.include, opt.out_dir, opt.checkpoint, opt.device, opt.opset, opt.atol)
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    sys.exit(0 if main(opt) else 1)
@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+
+from BirdCount.model_files.models_mae_cross import SupervisedMAE
+
+EXPORT_DIR = Path(__file__).resolve().parent / 'exported'
+
+# The counter is exported as three graphs so the encoder-latent and exemplar
+# caches keep working: windows -> latents, exemplar crops -> tokens, and
+# (latents, tokens) -> density
+GRAPHS = ('encoder', 'exemplars', 'decoder')
+SUFFIXES = {'onnx': '.onnx', 'torchscript': '.torchscript'}
+SHOT_TOKEN_FILE = 'shot_token.pt'
+
+
+def graph_path(export_dir, name, backend):
+    return Path(export_dir) / f"{name}{SUFFIXES[backend]}"
+
+
+class _OnnxGraph:
+    """ONNX Runtime session called like a module: torch tensors in, torch tensor out on the input device."""
+
+    def __init__(self, path, device):
+        import onnxruntime as ort
+
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda' and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, ('CUDAExecutionProvider', {'device_id': device.index or 0}))
+        self.session = ort.InferenceSession(str(path), providers=providers)
+        self.inputs = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, *tensors):
+        feeds = {name: t.detach().float().cpu().numpy() for name, t in zip(self.inputs, tensors)}
+        output = self.session.run(None, feeds)[0]
+        return torch.from_numpy(output).to(tensors[0].device)
+
+
+class ExportedMAE:
+    """
+    Drop-in for SupervisedMAE at inference time, running exported encoder,
+    exemplar and decoder graphs (ONNX Runtime or TorchScript) instead of the
+    eager modules. The entry points used by predict_density_maps are shared
+    with SupervisedMAE.
+    """
+
+    def __init__(self, export_dir, backend, device, latent_cache_size=0):
+        if backend not in SUFFIXES:
+            raise ValueError(f"Unknown BirdCount backend {backend!r}, expected one of {', '.join(SUFFIXES)}")
+        self.backend = backend
+        self.device = device
+        missing = [str(graph_path(export_dir, name, backend)) for name in GRAPHS
+                   if not graph_path(export_dir, name, backend).exists()]
+        if missing:
+            raise FileNotFoundError(f"Exported BirdCount graphs not found: {', '.join(missing)}")
+
+        if backend == 'onnx':
+            self._encoder, self._exemplars, self._decoder = (
+                _OnnxGraph(graph_path(export_dir, name, backend), device) for name in GRAPHS)
+        else:
+            self._encoder, self._exemplars, self._decoder = (
+                torch.jit.load(str(graph_path(export_dir, name, backend)), map_location=device).eval()
+                for name in GRAPHS)
+        self.shot_token = torch.load(Path(export_dir) / SHOT_TOKEN_FILE, map_location=device)
+
+        self.latent_cache_size = latent_cache_size
+        self._latent_cache = OrderedDict()
+        self._latent_cache_lock = threading.Lock()
+
+    # Same entry points (and latent LRU cache) as the eager model, on top of the exported graphs below
+    exemplar_embeddings = SupervisedMAE.exemplar_embeddings
+    encoder_latents = SupervisedMAE.encoder_latents
+
+    def forward_encoder(self, imgs):
+        with torch.no_grad():
+            return self._encoder(imgs)
+
+    def forward_exemplars(self, y_, shot_num=3):
+        n = y_.shape[0]
+        if shot_num <= 0:
+            return self.shot_token.repeat(n, 1).unsqueeze(1)
+        crops = y_[:, :shot_num].reshape(-1, *y_.shape[2:])  # [N*shot_num, 3, 64, 64]
+        with torch.no_grad():
+            tokens = self._exemplars(crops)
+        return tokens.reshape(n, shot_num, -1)
+
+    def forward_decoder(self, x, y_, shot_num=3, exemplar_embeddings=None):
+        if exemplar_embeddings is None:
+            exemplar_embeddings = self.forward_exemplars(y_, shot_num)
+        with torch.no_grad():
+            return self._decoder(x, exemplar_embeddings.to(x.device))
+
+    def __call__(self, imgs, boxes, shot_num, exemplar_embeddings=None):
+        return self.forward_decoder(self.forward_encoder(imgs), boxes, shot_num, exemplar_embeddings)
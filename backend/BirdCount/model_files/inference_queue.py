@@ -0,0 +1,190 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+
+from Common.shared_utils import logger
+from BirdCount.model_files.engine import get_engine
+from BirdCount.model_files import stage_timer
+
+# Set BIRDCOUNT_BATCHING=0 to run the model in the calling thread instead
+BATCHING = os.getenv('BIRDCOUNT_BATCHING', '1') != '0'
+# Windows collected from concurrent requests into one batch, and how long a batch waits for company when
+# requests are already queued (a request reaching an idle worker never waits)
+QUEUE_MAX_WINDOWS = int(os.getenv('BIRDCOUNT_QUEUE_MAX_WINDOWS', '16'))
+QUEUE_MAX_WAIT_MS = float(os.getenv('BIRDCOUNT_QUEUE_MAX_WAIT_MS', '10'))
+# Pending requests before submitters block (backpressure)
+QUEUE_MAX_PENDING = int(os.getenv('BIRDCOUNT_QUEUE_MAX_PENDING', '256'))
+
+METRICS_WINDOW_S = 60
+
+
+class _Job:
+    __slots__ = ('images', 'boxes', 'shot_num', 'image_keys', 'windows', 'future', 'enqueued', 'collector')
+
+    def __init__(self, images, boxes, shot_num, image_keys, windows):
+        self.images = images
+        self.boxes = boxes
+        self.shot_num = shot_num
+        self.image_keys = image_keys
+        self.windows = windows
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+        # The submitting thread's stage collector; the worker's stages are merged into it
+        self.collector = stage_timer.current()
+
+    def group(self):
+        # Jobs can share a forward pass when their images and exemplar counts line up
+        return self.shot_num, tuple(self.images.shape[1:]), self.images.device
+
+
+class InferenceQueue:
+    """
+    Micro-batching front end for predict_density_maps.
+
+    Request threads submit the preprocessed images of one request; a single
+    worker thread drains the queue up to `max_windows` sliding windows, runs
+    them through the model together and hands each request its density maps
+    back through a Future. A request that finds the worker idle is dispatched
+    at once; only when requests piled up behind a running batch does the next
+    batch wait up to `max_wait_ms` for more.
+    """
+
+    def __init__(self, max_windows=QUEUE_MAX_WINDOWS, max_wait_ms=QUEUE_MAX_WAIT_MS, max_pending=QUEUE_MAX_PENDING):
+        self.max_windows = max_windows
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.windows = 0
+        self.errors = 0
+        self._waits = deque(maxlen=1000)
+        self._runs = deque(maxlen=1000)
+        self._recent = deque()  # (finished_at, windows) within METRICS_WINDOW_S
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="birdcount-inference", daemon=True)
+                    self._thread.start()
+
+    def submit(self, images, boxes, shot_num=3, image_keys=None):
+        from BirdCount.model_files.demomodified import window_offsets
+
+        job = _Job(images, boxes, shot_num, image_keys, len(images) * len(window_offsets(images.shape[-1])))
+        self._ensure_worker()
+        self._queue.put(job)
+        return job.future
+
+    def predict(self, images, boxes, shot_num=3, image_keys=None):
+        """Blocking submit; returns the [N, h, w] density maps for `images`."""
+        return self.submit(images, boxes, shot_num, image_keys).result()
+
+    def _collect(self):
+        try:
+            batch = [self._queue.get_nowait()]
+            # Requests queued up while the last batch ran: under load, so wait briefly for more
+            deadline = time.perf_counter() + self.max_wait
+        except queue.Empty:
+            # Idle worker: a lone request runs right away, with whatever else is already queued
+            batch = [self._queue.get()]
+            deadline = None
+        windows = batch[0].windows
+        while windows < self.max_windows:
+            timeout = deadline - time.perf_counter() if deadline is not None else 0
+            try:
+                job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(job)
+            windows += job.windows
+        return batch
+
+    def _run(self):
+        from BirdCount.model_files.demomodified import predict_density_maps
+
+        while True:
+            batch = self._collect()
+            groups = {}
+            for job in batch:
+                groups.setdefault(job.group(), []).append(job)
+            for jobs in groups.values():
+                self._run_group(predict_density_maps, jobs)
+
+    def _run_group(self, predict_density_maps, jobs):
+        started = time.perf_counter()
+        collectors = [job.collector for job in jobs if job.collector is not None]
+        try:
+            images = torch.cat([job.images for job in jobs])
+            boxes = torch.cat([job.boxes for job in jobs])
+            image_keys = None
+            if any(job.image_keys is not None for job in jobs):
+                image_keys = [key for job in jobs for key in (job.image_keys or [None] * len(job.images))]
+            # Only collect when a submitter is, so the serving path doesn't pay for it
+            timing = stage_timer.collect(synchronize=any(sync for _, sync in collectors)) if collectors else nullcontext()
+            with timing as timings:
+                densities = predict_density_maps(get_engine().model, images, boxes, shot_num=jobs[0].shot_num,
+                                                 max_batch=max(self.max_windows, 1), image_keys=image_keys)
+            offset = 0
+            for job in jobs:
+                if job.collector is not None:
+                    # Merged before the result is set, so the submitter sees them once predict() returns
+                    job.collector[0]['queue_wait'].append(started - job.enqueued)
+                    stage_timer.merge(job.collector, timings)
+                job.future.set_result(densities[offset:offset + len(job.images)])
+                offset += len(job.images)
+        except Exception as e:
+            logger.error(f"BirdCount inference batch failed: {e}")
+            with self._metrics_lock:
+                self.errors += 1
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        windows = sum(job.windows for job in jobs)
+        with self._metrics_lock:
+            self.requests += len(jobs)
+            self.batches += 1
+            self.windows += windows
+            self._waits.extend(started - job.enqueued for job in jobs)
+            self._runs.append(finished - started)
+            self._recent.append((finished, windows))
+            while self._recent and self._recent[0][0] < finished - METRICS_WINDOW_S:
+                self._recent.popleft()
+
+    def stats(self):
+        with self._metrics_lock:
+            waits = np.array(self._waits) * 1000 if self._waits else np.zeros(1)
+            runs = np.array(self._runs) * 1000 if self._runs else np.zeros(1)
+            recent_windows = sum(w for _, w in self._recent)
+            return {
+                "enabled": BATCHING,
+                "pending": self._queue.qsize(),
+                "requests": self.requests,
+                "batches": self.batches,
+                "windows": self.windows,
+                "errors": self.errors,
+                "avg_windows_per_batch": self.windows / self.batches if self.batches else 0.0,
+                "avg_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+                "queue_wait_ms_p50": float(np.percentile(waits, 50)),
+                "queue_wait_ms_p95": float(np.percentile(waits, 95)),
+                "batch_run_ms_p50": float(np.percentile(runs, 50)),
+                "windows_per_second": recent_windows / METRICS_WINDOW_S,
+                "max_windows": self.max_windows,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+inference_queue = InferenceQueue()
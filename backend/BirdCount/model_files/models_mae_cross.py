@@ -1,5 +1,7 @@
 from functools import partial
+from collections import OrderedDict
 import math
+import threading
 import matplotlib
 matplotlib.use('Agg')
 import numpy as np
@@ -17,7 +19,7 @@ class SupervisedMAE(nn.Module):
     def __init__(self, img_size=384, patch_size=16, in_chans=3,
                  embed_dim=1024, depth=24, num_heads=16,
                  decoder_embed_dim=512, decoder_depth=2, decoder_num_heads=16,
-                 mlp_ratio=4., norm_layer=nn.LayerNorm, norm_pix_loss=False):
+                 mlp_ratio=4., norm_layer=nn.LayerNorm, norm_pix_loss=False, latent_cache_size=0):
         super().__init__()
 
         # --------------------------------------------------------------------------
@@ -101,6 +103,11 @@ class SupervisedMAE(nn.Module):
 
         self.norm_pix_loss = norm_pix_loss
 
+        # Encoder outputs keyed by (image key, window offset), see encoder_latents(); 0 disables
+        self.latent_cache_size = latent_cache_size
+        self._latent_cache = OrderedDict()
+        self._latent_cache_lock = threading.Lock()
+
         self.initialize_weights()
 
     def initialize_weights(self):
@@ -145,12 +152,7 @@ class SupervisedMAE(nn.Module):
 
         return x
 
-    def forward_decoder(self, x, y_, shot_num=3):
-        # embed tokens
-        x = self.decoder_embed(x)
-        # add pos embed
-        x = x + self.decoder_pos_embed
-
+    def forward_exemplars(self, y_, shot_num=3):
         # Exemplar encoder
         y_ = y_.transpose(0,1) # y_ [N,3,3,64,64]->[3,N,3,64,64]
         y1=[]
@@ -169,10 +171,62 @@ class SupervisedMAE(nn.Module):
             y1.append(yi.squeeze(-1).squeeze(-1)) # yi [N,C,1,1]->[N,C]       
             
         if shot_num > 0:
-            y = torch.cat(y1,dim=0).reshape(shot_num,N,C).to(x.device)
+            y = torch.cat(y1,dim=0).reshape(shot_num,N,C)
         else:
-            y = self.shot_token.repeat(y_.shape[1],1).unsqueeze(0).to(x.device)
+            y = self.shot_token.repeat(y_.shape[1],1).unsqueeze(0)
         y = y.transpose(0,1) # y [3,N,C]->[N,3,C]
+        return y
+
+    def exemplar_embeddings(self, boxes, shot_num=3):
+        """
+        Exemplar tokens for each image in `boxes` ([N,3,3,64,64] -> [N,shot_num,C]),
+        in one batched pass. Callers compute them once per image and reuse them
+        for every window, see predict_density_maps().
+        """
+        with torch.no_grad():
+            return self.forward_exemplars(boxes, shot_num)
+
+    def encoder_latents(self, imgs, keys=None):
+        """
+        Encoder outputs for a batch of windows ([N,3,384,384] -> [N,L,C]).
+        The encoder doesn't see the exemplars, so when callers key each window
+        (e.g. by image hash and window offset) its latent is cached and a recount
+        with different exemplars or shot_num only runs the decoder. None keys
+        are not cached.
+        """
+        if keys is None or self.latent_cache_size <= 0:
+            with torch.no_grad():
+                return self.forward_encoder(imgs)
+
+        latents = [None] * len(keys)
+        with self._latent_cache_lock:
+            for j, key in enumerate(keys):
+                latent = self._latent_cache.get(key) if key is not None else None
+                if latent is not None:
+                    self._latent_cache.move_to_end(key)
+                    latents[j] = latent
+        missing = [j for j, latent in enumerate(latents) if latent is None]
+        if missing:
+            with torch.no_grad():
+                computed = self.forward_encoder(imgs[missing])
+            with self._latent_cache_lock:
+                for j, latent in zip(missing, computed):
+                    latents[j] = latent
+                    if keys[j] is not None:
+                        self._latent_cache[keys[j]] = latent
+                while len(self._latent_cache) > self.latent_cache_size:
+                    self._latent_cache.popitem(last=False)
+        return torch.stack(latents)
+
+    def forward_decoder(self, x, y_, shot_num=3, exemplar_embeddings=None):
+        # embed tokens
+        x = self.decoder_embed(x)
+        # add pos embed
+        x = x + self.decoder_pos_embed
+
+        if exemplar_embeddings is None:
+            exemplar_embeddings = self.forward_exemplars(y_, shot_num)
+        y = exemplar_embeddings.to(x.device)
         
         # apply Transformer blocks
         for blk in self.decoder_blocks:
@@ -196,12 +250,12 @@ class SupervisedMAE(nn.Module):
 
         return x
 
-    def forward(self, imgs, boxes, shot_num):
+    def forward(self, imgs, boxes, shot_num, exemplar_embeddings=None):
         # if boxes.nelement() > 0:
         #     torchvision.utils.save_image(boxes[0], f"data/out/crops/box_{time.time()}_{random.randint(0, 99999):>5}.png")
         with torch.no_grad():
             latent = self.forward_encoder(imgs)
-        pred = self.forward_decoder(latent, boxes, shot_num)  # [N, 384, 384]
+        pred = self.forward_decoder(latent, boxes, shot_num, exemplar_embeddings)  # [N, 384, 384]
         return pred
 
 
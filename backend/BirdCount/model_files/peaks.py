@@ -0,0 +1,90 @@
+import base64
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Response encodings for peak coordinates
+PEAKS_POINTS = 'points'      # [{"x": .., "y": ..}, ...] (what annotations store)
+PEAKS_COLUMNAR = 'columnar'  # {"x": [..], "y": [..]}
+PEAKS_PACKED = 'packed'      # base64 of little-endian int16 (x, y) pairs, int32 if a coordinate needs it
+PEAKS_ENCODINGS = (PEAKS_POINTS, PEAKS_COLUMNAR, PEAKS_PACKED)
+
+
+def find_peaks(density_map, threshold, min_distance=3):
+    """
+    Local maxima of a density map above `threshold`, via max-pool NMS on the
+    map's own device. Matches `ndimage.maximum_filter(size=min_distance)`
+    (including its window placement for even sizes) but only the peak
+    indices cross to the host.
+
+    Args:
+        density_map (torch.Tensor or np.ndarray): [h, w] density map.
+
+    Returns:
+        np.ndarray: [N, 2] int32 (x, y) coordinates in row-major order.
+    """
+    if not isinstance(density_map, torch.Tensor):
+        density_map = torch.from_numpy(np.ascontiguousarray(density_map))
+    d = density_map.detach().float()
+    h, w = d.shape
+    k = max(int(min_distance), 1)
+    pooled = F.max_pool2d(d[None, None], kernel_size=k, stride=1, padding=k // 2)[0, 0, :h, :w]
+    ys, xs = torch.nonzero((d == pooled) & (d > threshold), as_tuple=True)
+    return torch.stack([xs, ys], dim=1).to(torch.int32).cpu().numpy()
+
+
+def scale_peaks(points, from_size, to_size):
+    """Rescales [N, 2] (x, y) points between (width, height) frames, truncating like int()."""
+    if not len(points):
+        return points
+    scale = np.array([to_size[0] / from_size[0], to_size[1] / from_size[1]])
+    return (points * scale).astype(np.int32)
+
+
+def pack_peaks(points):
+    """
+    Packs [N, 2] (x, y) points as little-endian int16 pairs (int32 if a
+    coordinate doesn't fit). Returns (bytes, "int16" | "int32").
+    """
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    if not len(points) or (points.min() >= -32768 and points.max() <= 32767):
+        return points.astype('<i2').tobytes(), "int16"
+    return points.astype('<i4').tobytes(), "int32"
+
+
+def unpack_peaks(data, width="int16"):
+    """Inverse of pack_peaks; [N, 2] int32 points."""
+    dtype = '<i2' if width == "int16" else '<i4'
+    return np.frombuffer(bytes(data), dtype=dtype).reshape(-1, 2).astype(np.int32)
+
+
+def encode_peaks(points, encoding=PEAKS_POINTS):
+    """Serializes [N, 2] (x, y) points (or legacy point dicts) for a JSON response."""
+    if isinstance(points, list):
+        points = decode_peaks(points)
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    if encoding == PEAKS_COLUMNAR:
+        return {"x": points[:, 0].tolist(), "y": points[:, 1].tolist()}
+    if encoding == PEAKS_PACKED:
+        data, width = pack_peaks(points)
+        return {
+            "encoding": width,
+            "count": len(points),
+            "data": base64.b64encode(data).decode('ascii'),
+        }
+    return [{"x": int(x), "y": int(y)} for x, y in points.tolist()]
+
+
+def round_points(xy):
+    """[N, 2] int32 points from (x, y) pairs, rounded to the nearest pixel rather than truncated."""
+    return np.rint(np.asarray(xy, dtype=np.float64)).astype(np.int32).reshape(-1, 2)
+
+
+def decode_peaks(payload):
+    """Inverse of encode_peaks for any of the encodings; returns [N, 2] int32 points."""
+    if isinstance(payload, list):
+        return round_points([[p["x"], p["y"]] for p in payload])
+    if "data" in payload:
+        return unpack_peaks(base64.b64decode(payload["data"]), payload.get("encoding", "int16"))
+    return round_points(np.stack([payload["x"], payload["y"]], axis=1))
@@ -0,0 +1,91 @@
+import torch
+
+# Density mass of one bird
+DENSITY_SCALE = 60
+# Mean exemplar-box count above which the count is divided by it (the boxes hold clusters, not single birds)
+EXEMPLAR_NORMALIZE_THRESHOLD = 1.8
+BOX_OUTLINE_VALUE = 10
+
+
+def grid_sums(density_map, rows=3, cols=3):
+    """
+    Sums of a [h, w] density map over a rows x cols grid, as a [rows, cols]
+    tensor on the map's device. Cell edges are at int(i * h / rows), like the
+    old per-cell slicing; when the grid divides the map this is one reshape
+    and reduce, otherwise two index_add passes.
+    """
+    h, w = density_map.shape
+    if h % rows == 0 and w % cols == 0:
+        return density_map.reshape(rows, h // rows, cols, w // cols).sum(dim=(1, 3))
+    device = density_map.device
+    row_ids = torch.bucketize(torch.arange(h, device=device),
+                              torch.tensor([int(i * h / rows) for i in range(1, rows)], device=device), right=True)
+    col_ids = torch.bucketize(torch.arange(w, device=device),
+                              torch.tensor([int(j * w / cols) for j in range(1, cols)], device=device), right=True)
+    by_row = torch.zeros((rows, w), dtype=density_map.dtype, device=device).index_add_(0, row_ids, density_map)
+    return torch.zeros((rows, cols), dtype=density_map.dtype, device=device).index_add_(1, col_ids, by_row)
+
+
+def box_sums(density_map, rects):
+    """
+    Density inside each [y1, x1, y2, x2] rectangle (inclusive, as preprocess
+    returns them) from one summed-area table and a single gather; [k] tensor.
+    """
+    h, w = density_map.shape
+    sat = torch.zeros((h + 1, w + 1), dtype=density_map.dtype, device=density_map.device)
+    sat[1:, 1:] = density_map.cumsum(0).cumsum(1)
+    r = torch.as_tensor(rects, device=density_map.device).reshape(-1, 4)
+    y1, x1 = r[:, 0].clamp(0, h), r[:, 1].clamp(0, w)
+    y2, x2 = (r[:, 2] + 1).clamp(0, h), (r[:, 3] + 1).clamp(0, w)
+    return sat[y2, x2] - sat[y1, x2] - sat[y2, x1] + sat[y1, x1]
+
+
+def exemplar_normalized_count(count, exemplar_counts, threshold=EXEMPLAR_NORMALIZE_THRESHOLD):
+    """Count divided by the mean exemplar-box count when that exceeds `threshold`; stays a tensor."""
+    mean = exemplar_counts.mean()
+    return torch.where(mean > threshold, count / mean, count)
+
+
+def box_outline_mask(shape, rects, device=None, value=BOX_OUTLINE_VALUE):
+    """
+    [h, w] map with `value` on the outline of each [y1, x1, y2, x2] rectangle,
+    drawn with one index_put_ instead of a Python loop per pixel. Edges run
+    from y1 to y2 - 1 (x1 to x2 - 1) and are clamped to the map, as the old
+    box_map loop did.
+    """
+    h, w = shape
+    mask = torch.zeros((h, w), device=device)
+    ys, xs = [], []
+    for y1, x1, y2, x2 in rects:
+        vertical = torch.arange(y1, y2, device=device)
+        horizontal = torch.arange(x1, x2, device=device)
+        ys += [vertical, vertical, torch.full_like(horizontal, y1), torch.full_like(horizontal, y2)]
+        xs += [torch.full_like(vertical, x1), torch.full_like(vertical, x2), horizontal, horizontal]
+    if ys:
+        mask.index_put_((torch.cat(ys).clamp(max=h - 1), torch.cat(xs).clamp(max=w - 1)),
+                        torch.tensor(float(value), device=device))
+    return mask
+
+
+def summarize(density_map, rows=3, cols=3, rects=None):
+    """
+    Count, grid counts and (with exemplar `rects`) the exemplar-normalized
+    count of a density map, computed on its device and brought to the host
+    with one transfer.
+
+    Returns:
+        dict: 'count' (float), 'grid' (rows * cols floats, row-major) and,
+        with rects, 'exemplar_count' (mean count inside the boxes) and
+        'normalized_count'.
+    """
+    grid = grid_sums(density_map, rows, cols).flatten() / DENSITY_SCALE
+    count = grid.sum()
+    parts = [count[None], grid]
+    if rects:
+        exemplar_counts = box_sums(density_map, rects) / DENSITY_SCALE
+        parts += [exemplar_counts.mean()[None], exemplar_normalized_count(count, exemplar_counts)[None]]
+    values = torch.cat(parts).tolist()  # the only host sync
+    summary = {'count': values[0], 'grid': values[1:1 + rows * cols]}
+    if rects:
+        summary['exemplar_count'], summary['normalized_count'] = values[-2:]
+    return summary
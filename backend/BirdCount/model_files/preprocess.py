@@ -0,0 +1,85 @@
+import io
+
+import torch
+import torchvision.transforms.functional as TF
+from PIL import Image
+
+from BirdCount.model_files.stage_timer import stage
+
+# Model input resolution (width, height)
+MODEL_W, MODEL_H = 480, 384
+# Exemplar boxes are expressed in the image scaled to this width (the old intermediate resize)
+EXEMPLAR_BASE_WIDTH = 1000
+EXEMPLAR_SIZE = 64
+
+# Coordinates of the default exemplar boxes, in the EXEMPLAR_BASE_WIDTH-wide image
+DEFAULT_EXEMPLARS = [
+    [[136, 98], [173, 127]],
+    [[209, 125], [742, 150]],
+    [[602, 168], [758, 200]]
+]
+
+
+def decode_image(source, draft=True):
+    """
+    Decodes an image once, to RGB.
+
+    `source` may be raw bytes, a path or a PIL image. JPEGs are decoded in
+    draft mode, letting libjpeg downscale by up to 8x during decoding while
+    staying at least model resolution, which is most of the decode cost on
+    large photos.
+
+    Returns:
+        (PIL.Image, (width, height)): the decoded image and the original size.
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        image = Image.open(source)
+    original_size = image.size
+    if draft and image.format == 'JPEG':
+        image.draft('RGB', (MODEL_W, MODEL_H))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    else:
+        image.load()
+    return image, original_size
+
+
+def exemplar_crops(samples, bboxes, scale_w, scale_h):
+    """Crops the exemplar boxes out of a [3,h,w] image and resizes each to 64×64."""
+    boxes = []
+    rects = []
+    for bbox in bboxes:
+        x1 = int(bbox[0][0] * scale_w)
+        y1 = int(bbox[0][1] * scale_h)
+        x2 = int(bbox[1][0] * scale_w)
+        y2 = int(bbox[1][1] * scale_h)
+        rects.append([y1, x1, y2, x2])
+        boxes.append(TF.resize(samples[:, y1:y2 + 1, x1:x2 + 1], [EXEMPLAR_SIZE, EXEMPLAR_SIZE]))
+    return torch.stack(boxes), rects
+
+
+def preprocess_image(source, exemplars=None):
+    """
+    Decode once and resize once, straight to model resolution.
+
+    Returns:
+        samples (torch.Tensor): [3, 384, 480] image in [0,1].
+        boxes (torch.Tensor): [3, 3, 64, 64] exemplar crops.
+        rects (list): exemplar rectangles as [y1, x1, y2, x2] in model pixels.
+    """
+    with stage('decode'):
+        image, (width, height) = decode_image(source)
+    with stage('resize'):
+        samples = TF.to_tensor(image.resize((MODEL_W, MODEL_H), Image.BILINEAR))
+
+    # Map exemplar coordinates from the EXEMPLAR_BASE_WIDTH-wide frame to model pixels
+    base_height = int(height * EXEMPLAR_BASE_WIDTH / float(width))
+    scale_w = MODEL_W / float(EXEMPLAR_BASE_WIDTH)
+    scale_h = MODEL_H / float(base_height)
+    with stage('exemplar_crops'):
+        boxes, rects = exemplar_crops(samples, exemplars or DEFAULT_EXEMPLARS, scale_w, scale_h)
+    return samples, boxes, rects
@@ -0,0 +1,91 @@
+import io
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.cm as cm
+
+from BirdCount.model_files.stage_timer import stage
+
+# Default encoding of heatmap responses: 'png', 'jpeg' or 'webp'
+HEATMAP_FORMAT = os.getenv('BIRDCOUNT_HEATMAP_FORMAT', 'png').lower()
+# zlib level for PNG (1 = fastest) and quality for the lossy formats
+PNG_COMPRESS_LEVEL = int(os.getenv('BIRDCOUNT_PNG_COMPRESS_LEVEL', '1'))
+LOSSY_QUALITY = int(os.getenv('BIRDCOUNT_HEATMAP_QUALITY', '85'))
+
+MEDIA_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+OVERLAY_ALPHA = 0.5
+
+# Same 256 colors matplotlib's 'jet' uses when given floats in [0, 1]
+JET_LUT = torch.from_numpy(cm.get_cmap('jet')(np.linspace(0, 1, 256))[:, :3]).float()
+
+_luts = {}
+
+
+def _lut(device):
+    lut = _luts.get(device)
+    if lut is None:
+        lut = _luts[device] = JET_LUT.to(device)
+    return lut
+
+
+def colorize(density_map):
+    """Maps a [h,w] density map to [h,w,3] jet colors in [0,1], normalized by its maximum."""
+    peak = density_map.max().clamp(min=1e-12)
+    index = (density_map / peak * 256).long().clamp_(0, 255)
+    return _lut(density_map.device)[index]
+
+
+def render_overlay(samples, density_map, alpha=OVERLAY_ALPHA):
+    """
+    Blends the jet-colored density map over the model-resolution image in one
+    pass on the density map's device.
+
+    Args:
+        samples (torch.Tensor): [1,3,h,w] or [3,h,w] image in [0,1].
+        density_map (torch.Tensor): [h',w'] density map; resized to (h,w) if needed.
+
+    Returns:
+        np.ndarray: [h,w,3] uint8 RGB overlay.
+    """
+    image = samples[0] if samples.dim() == 4 else samples
+    image = image.to(density_map.device)
+    colors = colorize(density_map).permute(2, 0, 1)
+    if colors.shape[1:] != image.shape[1:]:
+        colors = F.interpolate(colors.unsqueeze(0), size=image.shape[1:], mode='bilinear', antialias=True)[0]
+    blended = (1 - alpha) * image + alpha * colors
+    blended = blended.clamp_(0, 1).mul_(255).round_().to(torch.uint8)
+    return blended.permute(1, 2, 0).contiguous().cpu().numpy()
+
+
+def resolve_format(image_format=None):
+    image_format = (image_format or HEATMAP_FORMAT).lower()
+    if image_format == 'jpg':
+        image_format = 'jpeg'
+    if image_format not in MEDIA_TYPES:
+        raise ValueError(f"Unsupported heatmap format '{image_format}', expected one of {', '.join(MEDIA_TYPES)}")
+    return image_format
+
+
+def encode_image(image, image_format=None):
+    """
+    Encodes an RGB/grayscale uint8 array or PIL image once.
+
+    Returns:
+        (bytes, str): encoded image and its media type.
+    """
+    image_format = resolve_format(image_format)
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(image)
+    buffer = io.BytesIO()
+    with stage('encode'):
+        if image_format == 'png':
+            image.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+        else:
+            image.save(buffer, format=image_format.upper(), quality=LOSSY_QUALITY)
+    return buffer.getvalue(), MEDIA_TYPES[image_format]
@@ -0,0 +1,94 @@
+import numpy as np
+
+from BirdCount.model_files.postprocess import DENSITY_SCALE
+
+
+def row_prefix_sums(density_map):
+    """[h, w + 1] float64 prefix sums along each row, so any row span sums with two lookups."""
+    density_map = np.asarray(density_map, dtype=np.float64)
+    prefix = np.zeros((density_map.shape[0], density_map.shape[1] + 1))
+    np.cumsum(density_map, axis=1, out=prefix[:, 1:])
+    return prefix
+
+
+def polygon_spans(polygon, height, width):
+    """
+    Scanline rasterization of a polygon ([[x, y], ...] in map pixels) with the
+    even-odd rule at pixel centres. Returns (rows, x0, x1): the pixels
+    x0 <= x < x1 of each listed row are inside.
+    """
+    points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    xa, ya = points[:, 0], points[:, 1]
+    xb, yb = np.roll(xa, -1), np.roll(ya, -1)
+
+    y_lo = max(int(np.ceil(ya.min() - 0.5)), 0)
+    y_hi = min(int(np.ceil(ya.max() - 0.5)), height)
+    rows = np.arange(y_lo, y_hi)
+    if not len(rows) or len(points) < 3:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    # Crossings of every edge with every row centre, half-open in y so vertices count once
+    yc = rows[:, None] + 0.5
+    crosses = (ya <= yc) != (yb <= yc)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xs = xa + (yc - ya) * (xb - xa) / (yb - ya)
+    xs = np.where(crosses, xs, np.inf)
+    xs.sort(axis=1)
+
+    # Consecutive crossings pair up into inside spans; rows have an even number of them
+    n = crosses.sum(axis=1)
+    pair = np.arange(0, xs.shape[1] - 1, 2)
+    starts, ends = xs[:, pair], xs[:, pair + 1]
+    valid = pair[None, :] + 1 < n[:, None]
+    x0 = np.clip(np.ceil(starts - 0.5), 0, width).astype(np.int64)
+    x1 = np.clip(np.ceil(np.where(valid, ends, 0) - 0.5), 0, width).astype(np.int64)
+    keep = valid & (x1 > x0)
+    return np.broadcast_to(rows[:, None], keep.shape)[keep], x0[keep], x1[keep]
+
+
+def points_in_spans(points, spans):
+    """Boolean mask of which [N, 2] (x, y) integer pixels fall inside the spans."""
+    rows, x0, x1 = spans
+    if not len(points) or not len(rows):
+        return np.zeros(len(points), dtype=bool)
+    order = np.argsort(rows, kind='stable')
+    rows, x0, x1 = rows[order], x0[order], x1[order]
+    px, py = points[:, 0], points[:, 1]
+    lo, hi = np.searchsorted(rows, py, 'left'), np.searchsorted(rows, py, 'right')
+    inside = np.zeros(len(points), dtype=bool)
+    # A row rarely has more than a few spans, so loop over span slots rather than points
+    for k in range((hi - lo).max(initial=0)):
+        idx = np.minimum(lo + k, len(rows) - 1)
+        inside |= (lo + k < hi) & (x0[idx] <= px) & (px < x1[idx])
+    return inside
+
+
+def region_counts(density_map, polygons, peaks=None):
+    """
+    Count (and peaks) inside each polygon, from one set of row prefix sums
+    shared by all polygons: a polygon costs one rasterization plus two
+    lookups per covered row span, whatever its area.
+
+    Args:
+        density_map: [h, w] density map (numpy or CPU tensor).
+        polygons: list of [[x, y], ...] in density-map pixels.
+        peaks: optional [N, 2] (x, y) peaks of the whole map to split by polygon.
+
+    Returns:
+        list of dicts with 'count', 'pixels' and, with peaks, 'peaks' ([M, 2]).
+    """
+    prefix = row_prefix_sums(density_map)
+    height, width = prefix.shape[0], prefix.shape[1] - 1
+    regions = []
+    for polygon in polygons:
+        spans = polygon_spans(polygon, height, width)
+        rows, x0, x1 = spans
+        region = {
+            'count': float((prefix[rows, x1] - prefix[rows, x0]).sum() / DENSITY_SCALE),
+            'pixels': int((x1 - x0).sum()),
+        }
+        if peaks is not None:
+            region['peaks'] = peaks[points_in_spans(peaks, spans)]
+        regions.append(region)
+    return regions
@@ -0,0 +1,66 @@
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import torch
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """
+    Times one pipeline stage into the collector active on this thread (see
+    collect()). Without a collector it only costs an attribute lookup, so
+    stages stay in the serving path.
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _local.synchronize:
+            # CUDA kernels are asynchronous; without a sync their time lands in whichever stage syncs next
+            torch.cuda.synchronize()
+        timings[name].append(time.perf_counter() - start)
+
+
+@contextmanager
+def collect(synchronize=False):
+    """
+    Collects stage durations (seconds, one entry per call) on this thread:
+
+        with stage_timer.collect() as timings:
+            run_demo_image_nomongo(image)
+        timings['inference']  # [0.41]
+
+    Stages running on other threads are only seen when that work carries the
+    collector along (see current()/merge(); the inference queue does).
+    """
+    previous = getattr(_local, 'timings', None), getattr(_local, 'synchronize', False)
+    _local.timings = defaultdict(list)
+    _local.synchronize = synchronize and torch.cuda.is_available()
+    try:
+        yield _local.timings
+    finally:
+        _local.timings, _local.synchronize = previous
+
+
+def current():
+    """
+    The collector active on this thread as (timings, synchronize), or None.
+    Work handed to another thread carries it along so that thread's stages
+    can be merged back with merge().
+    """
+    timings = getattr(_local, 'timings', None)
+    return None if timings is None else (timings, _local.synchronize)
+
+
+def merge(collector, timings):
+    """Adds stage durations recorded on another thread to a collector from current()."""
+    for name, values in timings.items():
+        collector[0][name].extend(values)
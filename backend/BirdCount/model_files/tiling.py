@@ -0,0 +1,167 @@
+import os
+import math
+from collections import namedtuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import BirdCount.model_files.demomodified as demo
+from BirdCount.model_files.peaks import find_peaks
+from BirdCount.model_files.stage_timer import stage
+
+# Model input resolution every tile is resized to (width, height)
+MODEL_W, MODEL_H = 480, 384
+# Source pixels per model pixel; 1.0 feeds tiles at native resolution, 2.0 halves them
+TILE_SCALE = float(os.getenv('BIRDCOUNT_TILE_SCALE', '2.0'))
+# Fraction of a tile shared with each neighbour
+TILE_OVERLAP = float(os.getenv('BIRDCOUNT_TILE_OVERLAP', '0.2'))
+# Tiles per model call; bounds activation and decoded-crop memory on huge frames
+TILE_BATCH = int(os.getenv('BIRDCOUNT_TILE_BATCH', '8'))
+# Guards against pathological requests (e.g. a tiny GSD on a huge frame)
+MAX_TILES = int(os.getenv('BIRDCOUNT_MAX_TILES', '1024'))
+
+Tile = namedtuple('Tile', 'index row col x y w h')
+
+
+def tile_size(scale=None, source_gsd=None, target_gsd=None):
+    """
+    Tile size in source pixels. With ground-sample distances (e.g. cm/pixel of
+    the frame and the resolution the model should see) the scale is their
+    ratio; otherwise `scale` or BIRDCOUNT_TILE_SCALE is used.
+    """
+    if source_gsd and target_gsd:
+        scale = target_gsd / source_gsd
+    scale = max(scale or TILE_SCALE, 0.25)
+    return round(MODEL_W * scale), round(MODEL_H * scale)
+
+
+def axis_starts(length, tile, overlap):
+    """Evenly spread tile origins along one axis with at least `overlap` shared between neighbours."""
+    if length <= tile:
+        return [0], length
+    step = tile * (1 - overlap)
+    n = math.ceil((length - tile) / step) + 1
+    return [round(i * (length - tile) / (n - 1)) for i in range(n)], tile
+
+
+def core_bounds(starts, size, length):
+    """Per tile, the span it owns: seams sit in the middle of each overlap."""
+    lo = [0] + [(starts[i] + starts[i - 1] + size) / 2 for i in range(1, len(starts))]
+    hi = lo[1:] + [length]
+    return list(zip(lo, hi))
+
+
+def plan_tiles(width, height, tile_w, tile_h, overlap=TILE_OVERLAP):
+    xs, tw = axis_starts(width, tile_w, overlap)
+    ys, th = axis_starts(height, tile_h, overlap)
+    if len(xs) * len(ys) > MAX_TILES:
+        raise ValueError(f"{len(ys)}x{len(xs)} tiles exceeds the limit of {MAX_TILES}; use a larger tile size")
+    tiles = [Tile(r * len(xs) + c, r, c, x, y, tw, th) for r, y in enumerate(ys) for c, x in enumerate(xs)]
+    return tiles, core_bounds(xs, tw, width), core_bounds(ys, th, height)
+
+
+def feather(n, ramp):
+    """1-D blending weights rising linearly over `ramp` pixels at both ends."""
+    i = torch.arange(n, dtype=torch.float32) + 0.5
+    return torch.minimum(i, n - i).div(max(ramp, 1.0)).clamp(1e-3, 1.0)
+
+
+def dedupe_peaks(peaks, radius):
+    """
+    Greedy suppression of peaks from different tiles closer than `radius`,
+    strongest first. Peaks are (x, y, value, tile_index) in source pixels;
+    returns the kept [N, 2] int32 (x, y) points.
+    """
+    cell = max(radius, 1.0)
+    buckets = {}
+    kept = []
+    for x, y, value, tile in sorted(peaks, key=lambda p: -p[2]):
+        cx, cy = int(x // cell), int(y // cell)
+        duplicate = False
+        for nx in (cx - 1, cx, cx + 1):
+            for ny in (cy - 1, cy, cy + 1):
+                for ox, oy, otile in buckets.get((nx, ny), ()):
+                    if otile != tile and (ox - x) ** 2 + (oy - y) ** 2 <= radius ** 2:
+                        duplicate = True
+        if not duplicate:
+            buckets.setdefault((cx, cy), []).append((x, y, tile))
+            kept.append((int(x), int(y)))
+    return np.array(kept, dtype=np.int32).reshape(-1, 2)
+
+
+def count_tiled(image, tile_w=None, tile_h=None, overlap=TILE_OVERLAP, batch=TILE_BATCH,
+                peak_threshold=demo.PEAK_THRESHOLD, peak_min_distance=demo.PEAK_MIN_DISTANCE):
+    """
+    Counts a large image through overlapping tiles.
+
+    Tile density maps are resampled onto a canvas at model scale (MODEL_W
+    pixels per tile width), mass-preserving, and blended with feathered
+    weights so seams don't show. Peaks are found per tile, kept only inside
+    the tile's own core and de-duplicated across seams, and are returned in
+    full-image pixel coordinates.
+
+    Returns:
+        dict: 'count', 'peaks', 'density' (canvas tensor), 'tile_counts' and 'grid'.
+    """
+    image = image.convert("RGB")
+    width, height = image.size
+    if tile_w is None or tile_h is None:
+        tile_w, tile_h = tile_size()
+    tiles, x_cores, y_cores = plan_tiles(width, height, tile_w, tile_h, overlap)
+    tw, th = tiles[0].w, tiles[0].h
+
+    sx, sy = MODEL_W / tw, MODEL_H / th  # canvas pixels per source pixel
+    canvas_w, canvas_h = max(round(width * sx), 1), max(round(height * sy), 1)
+    weighted = torch.zeros(canvas_h, canvas_w)
+    weights = torch.zeros(canvas_h, canvas_w)
+
+    peaks = []
+    tile_counts = [0.0] * len(tiles)
+    for b in range(0, len(tiles), batch):
+        chunk = tiles[b:b + batch]
+        with stage('tile_crop'):
+            crops = [image.crop((t.x, t.y, t.x + t.w, t.y + t.h)) for t in chunk]
+        results = demo.count_images_nomongo(crops, {demo.OUTPUT_DENSITY})
+        for t, result in zip(chunk, results):
+            density = result[demo.OUTPUT_DENSITY].float().cpu()
+            dh, dw = density.shape
+            tile_counts[t.index] = density.sum().item() / 60
+
+            with stage('tile_blend'):
+                x0, x1 = round(t.x * sx), min(round((t.x + t.w) * sx), canvas_w)
+                y0, y1 = round(t.y * sy), min(round((t.y + t.h) * sy), canvas_h)
+                fw, fh = x1 - x0, y1 - y0
+                resampled = F.interpolate(density[None, None], size=(fh, fw), mode='bilinear', align_corners=False)[0, 0]
+                resampled *= (dh * dw) / (fh * fw)
+                weight = feather(fh, overlap * fh)[:, None] * feather(fw, overlap * fw)[None, :]
+                weighted[y0:y1, x0:x1] += resampled * weight
+                weights[y0:y1, x0:x1] += weight
+
+            with stage('tile_peaks'):
+                (core_x0, core_x1), (core_y0, core_y1) = x_cores[t.col], y_cores[t.row]
+                points = find_peaks(density, peak_threshold, peak_min_distance)
+                xs = t.x + (points[:, 0] + 0.5) * t.w / dw
+                ys = t.y + (points[:, 1] + 0.5) * t.h / dh
+                values = density.numpy()[points[:, 1], points[:, 0]]
+                core = (xs >= core_x0) & (xs < core_x1) & (ys >= core_y0) & (ys < core_y1)
+                peaks.extend((x, y, v, t.index) for x, y, v in zip(xs[core], ys[core], values[core]))
+
+    density = weighted / weights.clamp(min=1e-6)
+    radius = peak_min_distance * max(tw / MODEL_W, th / MODEL_H)
+    with stage('tile_dedupe'):
+        kept = dedupe_peaks(peaks, radius)
+    return {
+        'count': density.sum().item() / 60,
+        'peaks': kept,
+        'density': density,
+        'tile_counts': tile_counts,
+        'grid': {
+            'rows': tiles[-1].row + 1,
+            'cols': tiles[-1].col + 1,
+            'tile_width': tw,
+            'tile_height': th,
+            'overlap': overlap,
+            'tiles': [{'x': t.x, 'y': t.y, 'w': t.w, 'h': t.h} for t in tiles],
+        },
+    }
@@ -68,7 +68,8 @@ def parse_schema_file():
                 parts = line.split()
                 if len(parts) >= 2:
                     col_name = parts[0]
-                    col_type = parts[1].split('(')[0].upper()
+                    # "FLOAT, -- comment" leaves the comma on the type
+                    col_type = parts[1].split('(')[0].rstrip(',').upper()
                     columns.append((col_name, col_type))
                     
             expected_schema[table_name] = columns
@@ -178,7 +179,8 @@ def check_schema_match():
             'BOOLEAN': 'BOOLEAN',
             'INTEGER': 'INTEGER',
             'JSONB': 'JSONB',
-            'VECTOR': 'USER-DEFINED'    # ← added to accept pgvector columns
+            'VECTOR': 'USER-DEFINED',    # ← added to accept pgvector columns
+            'INTEGER[]': 'ARRAY'
         }
         
         expected_schema = parse_schema_file()
@@ -243,6 +245,38 @@ def check_schema_match():
         if conn:
             conn.close()
 
+def apply_additive_migrations():
+    """
+    Runs db/migrations.sql on an existing database. Its statements only add
+    (ADD COLUMN / CREATE ... IF NOT EXISTS), so new columns, tables and indexes
+    land in place and check_schema_match() doesn't fall back to recreating
+    the database.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection(DB_CONFIG["dbname"])
+        if not conn:
+            return False
+
+        cursor = conn.cursor()
+        migrations_path = Path(__file__).parent.parent / "db/migrations.sql"
+        with open(migrations_path, 'r') as f:
+            cursor.execute(f.read())
+        conn.commit()
+        logger.info("Additive migrations applied")
+        return True
+    except Error as e:
+        logger.error(f"Error applying migrations: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
 def drop_database():
     conn = None
     cursor = None
@@ -370,6 +404,9 @@ def initialize_database():
         cursor.execute(f"SELECT 1 FROM pg_database WHERE datname = '{DB_CONFIG['dbname']}'")
         db_exists = cursor.fetchone() is not None
         
+        if db_exists:
+            apply_additive_migrations()
+
         if db_exists and not check_schema_match():
             logger.info("Schema mismatch detected, recreating database with new ReID schema...")
             cursor.close()
@@ -0,0 +1,64 @@
+-- Additive, idempotent changes applied to existing databases before the schema check
+-- (see apply_additive_migrations). Anything added to schema.sql for tables that already
+-- exist belongs here too, otherwise the check drops and recreates the database.
+
+ALTER TABLE images ADD COLUMN IF NOT EXISTS predicted_count FLOAT;
+CREATE INDEX IF NOT EXISTS ix_images_user_model_id ON images(user_id, model_type, id);
+CREATE INDEX IF NOT EXISTS ix_annotations_image_id ON annotations(image_id);
+
+-- BirdCount points move from JSON to packed bytea; JSON rows are repacked when next read or edited
+ALTER TABLE annotations ADD COLUMN IF NOT EXISTS points BYTEA;
+ALTER TABLE annotations ADD COLUMN IF NOT EXISTS points_encoding VARCHAR(8);
+ALTER TABLE annotations ADD COLUMN IF NOT EXISTS point_count INTEGER;
+ALTER TABLE annotations ALTER COLUMN cluster_centers DROP NOT NULL;
+
+-- BirdCount active learning: per-user completions and per-box dots move out of the
+-- user_ids / dots arrays on active_learning_birdcount into their own tables
+CREATE TABLE IF NOT EXISTS active_learning_birdcount_completions (
+    image_id INTEGER REFERENCES images(id),
+    user_id INTEGER REFERENCES users(id),
+    completed_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (image_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS active_learning_birdcount_dots (
+    id SERIAL PRIMARY KEY,
+    image_id INTEGER REFERENCES images(id),
+    user_id INTEGER REFERENCES users(id),
+    dots JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS ix_active_learning_birdcount_created ON active_learning_birdcount(created_at, id);
+CREATE INDEX IF NOT EXISTS ix_active_learning_birdcount_dots_image ON active_learning_birdcount_dots(image_id);
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'active_learning_birdcount' AND column_name = 'user_ids'
+    ) THEN
+        INSERT INTO active_learning_birdcount_completions (image_id, user_id)
+        SELECT DISTINCT a.image_id, u.user_id
+        FROM active_learning_birdcount a, unnest(a.user_ids) AS u(user_id)
+        WHERE a.image_id IS NOT NULL AND u.user_id IS NOT NULL
+        ON CONFLICT DO NOTHING;
+
+        -- Every submit appended to all entries of the image, so the oldest entry holds the full list
+        INSERT INTO active_learning_birdcount_dots (image_id, dots)
+        SELECT first.image_id, box.dots
+        FROM (
+            SELECT DISTINCT ON (image_id) image_id, dots
+            FROM active_learning_birdcount
+            WHERE image_id IS NOT NULL AND jsonb_typeof(dots) = 'array'
+            ORDER BY image_id, jsonb_array_length(dots) DESC, id
+        ) first, jsonb_array_elements(first.dots) AS box(dots);
+
+        ALTER TABLE active_learning_birdcount DROP COLUMN user_ids, DROP COLUMN dots;
+    END IF;
+END $$;
+
+-- BirdCount density maps kept at upload, previously UPLOAD_DIR/density/<image_id>.npz
+CREATE TABLE IF NOT EXISTS density_maps (
+    image_id INTEGER PRIMARY KEY REFERENCES images(id) ON DELETE CASCADE,
+    density BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
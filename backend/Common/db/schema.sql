@@ -31,6 +31,7 @@ CREATE TABLE IF NOT EXISTS images (
     user_id INTEGER REFERENCES users(id),
     model_type INTEGER NOT NULL,
     consent BOOLEAN DEFAULT false,
+    predicted_count FLOAT, -- BirdCount model count at upload
     created_at TIMESTAMP DEFAULT NOW()
 );
 
@@ -77,7 +78,16 @@ CREATE TABLE IF NOT EXISTS annotations (
     image_id INTEGER REFERENCES images(id),
     width FLOAT NOT NULL,
     height FLOAT NOT NULL,
-    cluster_centers JSONB NOT NULL,
+    cluster_centers JSONB, -- legacy [{"x":..,"y":..}] points, NULL once repacked into points
+    points BYTEA, -- packed little-endian (x, y) pairs
+    points_encoding VARCHAR(8), -- int16 or int32
+    point_count INTEGER,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS density_maps (
+    image_id INTEGER PRIMARY KEY REFERENCES images(id) ON DELETE CASCADE,
+    density BYTEA NOT NULL, -- np.savez_compressed float16 [h, w] BirdCount density map
     created_at TIMESTAMP DEFAULT NOW()
 );
 
@@ -220,8 +230,29 @@ CREATE TABLE IF NOT EXISTS image_embeddings (
 CREATE TABLE IF NOT EXISTS active_learning_birdcount (
     id SERIAL PRIMARY KEY,
     image_id INTEGER REFERENCES images(id),
-    user_ids INTEGER[] DEFAULT '{}',
     boxes JSONB NOT NULL,
-    dots JSONB DEFAULT '[]',
     created_at TIMESTAMP DEFAULT NOW()
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS active_learning_birdcount_completions (
+    image_id INTEGER REFERENCES images(id),
+    user_id INTEGER REFERENCES users(id),
+    completed_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (image_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS active_learning_birdcount_dots (
+    id SERIAL PRIMARY KEY,
+    image_id INTEGER REFERENCES images(id),
+    user_id INTEGER REFERENCES users(id), -- NULL for dots migrated from the unattributed array
+    dots JSONB NOT NULL, -- one box's [{"x":..,"y":..}]
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Keyset pagination of a user's images per task, and annotation lookups per image
+CREATE INDEX IF NOT EXISTS ix_images_user_model_id ON images(user_id, model_type, id);
+CREATE INDEX IF NOT EXISTS ix_annotations_image_id ON annotations(image_id);
+
+-- Active-learning queue walked in created_at order, skipping (image, user) completions via their primary key
+CREATE INDEX IF NOT EXISTS ix_active_learning_birdcount_created ON active_learning_birdcount(created_at, id);
+CREATE INDEX IF NOT EXISTS ix_active_learning_birdcount_dots_image ON active_learning_birdcount_dots(image_id);
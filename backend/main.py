@@ -24,6 +24,8 @@ from ObjectDetection.api.utils.scheduler import check_and_update_rankings
 from BirdCount.api.annotations import router as annotations_router
 from BirdCount.api.model_api import router as model_api_router
 from BirdCount.api.active_learning import router as active_learning_router
+from BirdCount.api.images import router as birdcount_images_router
+from BirdCount.model_files import engine as birdcount_engine
 
 from ReID.api.reid import router as reid_router
 from ReID.auto_truncate_utils import cleanup_non_consented_reid_data
@@ -89,6 +91,10 @@ async def startup_event():
         )
         logger.info("CLIP model and processor loaded successfully")
         
+        if birdcount_engine.WARMUP == "background":
+            birdcount_engine.start_background_warm_up()
+            logger.info("BirdCount model warm-up started in background")
+        
         scheduler = BackgroundScheduler(timezone="UTC")
         scheduler.add_job(check_and_update_rankings, 'interval', minutes=1)
         
@@ -126,6 +132,7 @@ app.include_router(cleanup_router)
 app.include_router(annotations_router)
 app.include_router(model_api_router)
 app.include_router(active_learning_router)
+app.include_router(birdcount_images_router)
 
 #RE ID
 app.include_router(reid_router, prefix="/reid")
@@ -0,0 +1,42 @@
+"""Exported TorchScript / ONNX graphs must count like the eager SupervisedMAE they came from."""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("timm")
+import torch.nn as nn
+from functools import partial
+
+from BirdCount.model_files.models_mae_cross import SupervisedMAE
+from BirdCount.model_files.exported_model import ExportedMAE, SHOT_TOKEN_FILE
+from BirdCount.model_files import export
+from BirdCount.benchmarks.fixtures import synthetic_image
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    # Same architecture as mae_vit_base_patch16, a fraction of the width and depth, random weights
+    torch.manual_seed(0)
+    model = SupervisedMAE(embed_dim=64, depth=1, num_heads=4, decoder_embed_dim=64, decoder_depth=1,
+                          decoder_num_heads=4, norm_layer=partial(nn.LayerNorm, eps=1e-6))
+    return model.eval()
+
+
+@pytest.mark.parametrize("backend", ["torchscript", "onnx"])
+def test_exported_matches_eager(tiny_model, tmp_path, backend):
+    if backend == "onnx":
+        pytest.importorskip("onnx")
+        pytest.importorskip("onnxruntime")
+    device = torch.device("cpu")
+    inputs = export.example_inputs(tiny_model, device)
+    if backend == "onnx":
+        export.export_onnx(tiny_model, inputs, tmp_path, opset=17)
+    else:
+        export.export_torchscript(tiny_model, inputs, tmp_path)
+    torch.save(tiny_model.shot_token.detach().cpu(), tmp_path / SHOT_TOKEN_FILE)
+
+    # Images are resized to 480x384: two overlapping 384 windows, so the sliding-window merge is covered too
+    max_diff, count_diff = export.check_parity(tiny_model, ExportedMAE(tmp_path, backend, device), device,
+                                               image=synthetic_image(1600, 1200, birds=50))
+    assert max_diff <= export.PARITY_ATOL
+    assert count_diff <= export.PARITY_ATOL
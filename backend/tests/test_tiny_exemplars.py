@@ -0,0 +1,63 @@
+"""Counting with tiny exemplar boxes (the 3x3 upscaled-crop path) must cover the whole image."""
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+from PIL import Image, ImageDraw
+
+import BirdCount.model_files.demomodified as demo
+from BirdCount.model_files import engine as counting_engine
+from BirdCount.benchmarks.pipeline import StubEngine
+
+WIDTH, HEIGHT = 960, 768
+# 4-px boxes in a 960-px image: ~2 model px, well under TINY_EXEMPLAR_PX
+TINY_BOXES = [(100, 100, 104, 104)] * 3
+
+
+@pytest.fixture
+def stub_engine(monkeypatch):
+    # The stub's density is the image's darkness, so a white image with dark blobs puts mass only under the blobs
+    monkeypatch.setattr(counting_engine, "_engine", StubEngine(torch.device("cpu")))
+    monkeypatch.setattr(demo, "BATCHING", False)
+
+
+def image_with_blobs(cells):
+    image = Image.new("RGB", (WIDTH, HEIGHT), "white")
+    draw = ImageDraw.Draw(image)
+    for row, col in cells:
+        cx, cy = (col + 0.5) * WIDTH / 3, (row + 0.5) * HEIGHT / 3
+        draw.ellipse([cx - 20, cy - 20, cx + 20, cy + 20], fill="black")
+    return image
+
+
+def recount(image):
+    exemplars = demo.scale_exemplars(TINY_BOXES, WIDTH)
+    return demo.count_images_nomongo([image], {demo.OUTPUT_GRID, demo.OUTPUT_DENSITY}, exemplars=exemplars)[0]
+
+
+def test_tiny_boxes_take_the_crop_path():
+    samples = torch.zeros((1, 3, 384, 480))
+    _, _, rects = demo.preprocess_image(image_with_blobs([]), demo.scale_exemplars(TINY_BOXES, WIDTH))
+    assert len(demo.density_inputs(samples, rects)) == 9
+
+
+@pytest.mark.parametrize("cell", [(0, 0), (1, 2), (2, 2)])
+def test_mass_stays_in_its_cell(stub_engine, cell):
+    grid = np.array(recount(image_with_blobs([cell]))[demo.OUTPUT_GRID]).reshape(3, 3)
+    assert grid[cell] > 0
+    others = np.delete(grid.flatten(), cell[0] * 3 + cell[1])
+    assert np.all(others < grid[cell] * 1e-3)
+
+
+def test_every_cell_is_counted(stub_engine):
+    result = recount(image_with_blobs([(r, c) for r in range(3) for c in range(3)]))
+    assert result[demo.OUTPUT_DENSITY].shape == (384, 480)
+    assert all(count > 0 for count in result[demo.OUTPUT_GRID])
+
+
+def test_merge_keeps_each_crop_mass():
+    crops = torch.rand((9, 384, 480))
+    merged = demo.merge_crop_densities(crops, 384, 480)
+    for density, (top, left, ch, cw) in zip(crops, demo.crop_cells(384, 480)):
+        assert torch.isclose(merged[top:top + ch, left:left + cw].sum(), density.sum(), rtol=1e-4)